@@ -0,0 +1,201 @@
+"""
+Semantic cache of chat answers.
+
+A new question reuses a stored answer when its embedding is within `threshold` cosine similarity
+of a cached question and retrieval returned exactly the same context. Entries are evicted least
+recently used first, persisted in SQLite one row at a time, and dropped when the embeddings
+file changes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_THRESHOLD = float(os.getenv('DOCUSEARCH_ANSWER_CACHE_THRESHOLD', '0.95'))
+DEFAULT_MAX_ENTRIES = int(os.getenv('DOCUSEARCH_ANSWER_CACHE_SIZE', '500'))
+
+def hash_context(search_results):
+    """Fingerprint of the retrieved documents and passages a chat answer was built from"""
+    digest = hashlib.sha256()
+    for result in search_results:
+        digest.update((result.get('file_path') or '').encode('utf-8'))
+        for passage in result.get('passages', [result]):
+            digest.update(b'\0')
+            digest.update(passage['content'].encode('utf-8'))
+        digest.update(b'\1')
+    return digest.hexdigest()
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+class SemanticAnswerCache:
+    def __init__(self, path=None, index_version=None, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.index_version = index_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_cost = 0.0
+        self._entries = []
+        self._matrix = None  # Stacked question embeddings, rebuilt after changes
+        self._lock = threading.Lock()
+        self._db = None
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY,
+                    query TEXT,
+                    embedding BLOB,
+                    context_hash TEXT,
+                    answer TEXT,
+                    sources TEXT,
+                    cost REAL,
+                    created REAL,
+                    last_used REAL,
+                    hits INTEGER
+                )
+            ''')
+            self._db.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+            row = self._db.execute("SELECT value FROM settings WHERE key = 'index_version'").fetchone()
+            if row is None or row[0] != self.index_version:
+                # Answers were built from a different embeddings file
+                count = self._db.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+                if count:
+                    print(f"Embeddings changed, discarding {count} cached answers")
+                self._db.execute('DELETE FROM answers')
+                self._db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('index_version', ?)",
+                                 (self.index_version,))
+            self._db.commit()
+            rows = self._db.execute(
+                'SELECT id, query, embedding, context_hash, answer, sources, cost, created, last_used, hits FROM answers'
+            ).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not open answer cache {self.path}: {str(e)}")
+            self._db = None
+            return
+        for row in rows:
+            self._entries.append({
+                'id': row[0],
+                'query': row[1],
+                'embedding': np.frombuffer(row[2], dtype=np.float32),
+                'context_hash': row[3],
+                'answer': row[4],
+                'sources': json.loads(row[5]),
+                'cost': row[6],
+                'created': row[7],
+                'last_used': row[8],
+                'hits': row[9]
+            })
+
+    def _write(self, statement, params=()):
+        """Run one statement against the cache file; a failed write only costs persistence"""
+        if self._db is None:
+            return None
+        try:
+            cursor = self._db.execute(statement, params)
+            self._db.commit()
+            return cursor
+        except sqlite3.Error as e:
+            print(f"Could not write answer cache {self.path}: {str(e)}")
+            return None
+
+    def lookup(self, query_embedding, context_hash):
+        """Cached entry for a near-identical question over the same context, or None"""
+        query = _normalize(query_embedding)
+        with self._lock:
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix = np.stack([entry['embedding'] for entry in self._entries])
+                similarities = self._matrix @ query
+                for idx in np.argsort(-similarities):
+                    if similarities[idx] < self.threshold:
+                        break
+                    entry = self._entries[idx]
+                    if entry['context_hash'] == context_hash:
+                        entry['last_used'] = time.time()
+                        entry['hits'] = entry.get('hits', 0) + 1
+                        self._write('UPDATE answers SET last_used = ?, hits = ? WHERE id = ?',
+                                    (entry['last_used'], entry['hits'], entry.get('id')))
+                        self.hits += 1
+                        self.saved_cost += entry.get('cost', 0.0)
+                        return entry
+            self.misses += 1
+            return None
+
+    def store(self, query, query_embedding, context_hash, answer, sources, cost=0.0):
+        now = time.time()
+        entry = {
+            'query': query,
+            'embedding': _normalize(query_embedding),
+            'context_hash': context_hash,
+            'answer': answer,
+            'sources': sources,
+            'cost': cost,
+            'created': now,
+            'last_used': now,
+            'hits': 0
+        }
+        with self._lock:
+            # One row per answer, so a store costs the same however full the cache is
+            cursor = self._write(
+                'INSERT INTO answers (query, embedding, context_hash, answer, sources, cost, created, last_used, hits) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (query, entry['embedding'].tobytes(), context_hash, answer, json.dumps(sources), cost, now, now, 0)
+            )
+            entry['id'] = cursor.lastrowid if cursor is not None else None
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                # Evict the least recently used answers
+                self._entries.sort(key=lambda entry: entry['last_used'], reverse=True)
+                evicted = [(old['id'],) for old in self._entries[self.max_entries:] if old.get('id') is not None]
+                del self._entries[self.max_entries:]
+                if evicted and self._db is not None:
+                    try:
+                        self._db.executemany('DELETE FROM answers WHERE id = ?', evicted)
+                        self._db.commit()
+                    except sqlite3.Error as e:
+                        print(f"Could not write answer cache {self.path}: {str(e)}")
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._matrix = None
+            self._write('DELETE FROM answers')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'saved_cost': self.saved_cost
+            }
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_answer_cache(cache_dir, index_path, index_version):
+    """Process-wide cache for one embeddings file, persisted under cache_dir"""
+    name = hashlib.sha1(os.path.abspath(str(index_path)).encode('utf-8')).hexdigest()[:12]
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None or cache.index_version != index_version:
+            cache = SemanticAnswerCache(os.path.join(cache_dir, f"answers_{name}.db"), index_version)
+            _caches[name] = cache
+    return cache
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+BM25 inverted index over the `content` of each embeddings record, in pure NumPy.
+
+Postings are stored term by term (CSR layout) with the BM25 term-frequency weight already
+computed, so scoring a query is one gather and add per query term. Query terms missing from
+the vocabulary ("payplaa") are expanded to close vocabulary terms or split into two known
+words, so misspellings still get lexical matches.
+
+Usage: python bm25_index.py embeddings/embeddings_light.json ["pay plan" "payplaa" ...]
+builds and saves the index next to the embeddings, then reports per-query latency.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+TOKEN_RE = re.compile(r'\w+')
+# Fuzzy matches below this difflib ratio are ignored
+FUZZY_CUTOFF = 0.75
+MAX_EXPANSIONS = 3
+# Expansions of out-of-vocabulary terms remembered per index (queries can contain any term)
+EXPANSION_CACHE_SIZE = 4096
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+def _trigrams(term):
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class BM25Index:
+    def __init__(self, terms, offsets, doc_ids, weights, idf):
+        # Postings of terms[t] are doc_ids[offsets[t]:offsets[t + 1]], with matching weights
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.num_docs = int(doc_ids.max()) + 1 if len(doc_ids) else 0
+        self.term_ids = {term: idx for idx, term in enumerate(terms.tolist())}
+        self._trigram_index = None  # Built on the first misspelled query
+        # Bounded and thread-safe: the index is shared by every session
+        self._expand_unknown_cached = lru_cache(maxsize=EXPANSION_CACHE_SIZE)(self._expand_unknown)
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        postings = defaultdict(list)  # term -> [(doc id, term frequency)]
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text or ""))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((doc_id, tf))
+
+        average_length = doc_lengths.mean() if len(texts) and doc_lengths.mean() > 0 else 1.0
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for idx, term in enumerate(terms):
+            for doc_id, tf in postings[term]:
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+            offsets[idx + 1] = len(doc_ids)
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        # Length-normalized term-frequency part of BM25, precomputed per posting
+        norm = k1 * (1 - b + b * doc_lengths[doc_ids] / average_length)
+        weights = (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        doc_freq = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (len(texts) - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        index = cls(np.asarray(terms, dtype=str), offsets, doc_ids, weights, idf)
+        index.num_docs = len(texts)
+        return index
+
+    def _fuzzy(self, term):
+        """(term id, similarity) of vocabulary terms spelled like term"""
+        if self._trigram_index is None:
+            # Published only once complete, so concurrent queries never see a partial index
+            trigram_index = defaultdict(list)
+            for idx, vocabulary_term in enumerate(self.terms.tolist()):
+                for trigram in _trigrams(vocabulary_term):
+                    trigram_index[trigram].append(idx)
+            self._trigram_index = trigram_index
+        shared = Counter()
+        for trigram in _trigrams(term):
+            shared.update(self._trigram_index.get(trigram, ()))
+        matches = []
+        for idx, _ in shared.most_common(50):
+            ratio = difflib.SequenceMatcher(None, term, self.terms[idx]).ratio()
+            if ratio >= FUZZY_CUTOFF:
+                matches.append((idx, ratio))
+        matches.sort(key=lambda match: -match[1])
+        return matches[:MAX_EXPANSIONS]
+
+    def expand_term(self, term):
+        """(term id, weight) pairs a query term contributes to the score"""
+        if term in self.term_ids:
+            return [(self.term_ids[term], 1.0)]
+        return self._expand_unknown_cached(term)
+
+    def _expand_unknown(self, term):
+        expansions = self._fuzzy(term)
+        if expansions:
+            return expansions
+        # Run-together words ("payplan"): a known prefix plus a known or fuzzy suffix
+        for split in range(len(term) - 3, 2, -1):
+            head, tail = term[:split], term[split:]
+            if head in self.term_ids:
+                tail_terms = [(self.term_ids[tail], 1.0)] if tail in self.term_ids else self._fuzzy(tail)
+                if tail_terms:
+                    return [(self.term_ids[head], 1.0)] + tail_terms[:1]
+        return []
+
+    def scores(self, query):
+        """BM25 score of every document for the query text"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            for term_id, weight in self.expand_term(term):
+                start, end = self.offsets[term_id], self.offsets[term_id + 1]
+                # Each document appears once per term, so fancy-index += is safe
+                scores[self.doc_ids[start:end]] += (weight * self.idf[term_id]) * self.weights[start:end]
+        return scores
+
+    def save(self, path):
+        np.savez(path, terms=self.terms, offsets=self.offsets, doc_ids=self.doc_ids,
+                 weights=self.weights, idf=self.idf, num_docs=self.num_docs)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data['terms'], data['offsets'], data['doc_ids'], data['weights'], data['idf'])
+            index.num_docs = int(data['num_docs'])
+        return index
+
+def bm25_path_for(embeddings_path):
+    """Where the BM25 index for an embeddings file or store lives"""
+    embeddings_path = str(embeddings_path).rstrip("/\\")
+    if os.path.isdir(embeddings_path):
+        return os.path.join(embeddings_path, "bm25.npz")
+    return os.path.splitext(embeddings_path)[0] + ".bm25.npz"
+
+def build_bm25_index(embeddings_data, embeddings_path=None):
+    """Index the content of each record (same row order as the embeddings) and optionally save it"""
+    index = BM25Index.build([item.get('content', '') for item in embeddings_data])
+    if embeddings_path:
+        index.save(bm25_path_for(embeddings_path))
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a BM25 index for an embeddings file and time queries")
+    parser.add_argument("embeddings_path")
+    parser.add_argument("queries", nargs="*", default=["pay plan", "payplaa", "water rate"])
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    from search_index import load_search_index, top_k_indices
+
+    def load_json(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    index = load_search_index(args.embeddings_path, load_json, index_type='flat', hybrid='off')
+    start = time.perf_counter()
+    bm25 = build_bm25_index(index.records, args.embeddings_path)
+    print(f"Indexed {len(index)} records, {len(bm25.terms)} terms in {time.perf_counter() - start:.2f}s, "
+          f"saved to {bm25_path_for(args.embeddings_path)}")
+
+    for query in args.queries:
+        bm25.scores(query)  # Warm the trigram index
+        start = time.perf_counter()
+        for _ in range(100):
+            scores = bm25.scores(query)
+        ms = (time.perf_counter() - start) * 10
+        expanded = [str(bm25.terms[term_id]) for term in tokenize(query) for term_id, _ in bm25.expand_term(term)]
+        print(f"\n{query!r} -> {expanded}, {ms:.3f} ms/query")
+        for idx in top_k_indices(scores, args.top_k):
+            if scores[idx] > 0:
+                print(f"  {scores[idx]:.2f}  {index.records[idx].get('source_url') or index.records[idx]['file_path']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Chat cost accounting.
+
+Costs come from the `usage` block the API returns with every completion (streamed completions
+include it in their last chunk). Only when usage is missing are tokens counted locally, with
+the cached tiktoken encoder. Process-wide totals go to the metrics module.
+"""
+
+import metrics
+from context_builder import CHAT_MODEL, count_message_tokens, count_tokens
+
+# USD per 1K tokens (input, output), prices as of October 2024
+PRICES_PER_1K = {
+    "gpt-4o-mini": (0.000150, 0.000600),
+}
+
+def calculate_cost(prompt_tokens, completion_tokens, model=CHAT_MODEL):
+    input_price, output_price = PRICES_PER_1K[model]
+    return (prompt_tokens / 1000) * input_price + (completion_tokens / 1000) * output_price
+
+def usage_from_response(usage, messages, answer, model=CHAT_MODEL):
+    """Token counts for one completion: the API usage block, or a local estimate if it is missing"""
+    if usage is not None:
+        return {
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'estimated': False
+        }
+    try:
+        return {
+            'prompt_tokens': count_message_tokens(messages, model),
+            'completion_tokens': count_tokens(answer or "", model),
+            'estimated': True
+        }
+    except Exception as e:
+        print(f"Could not estimate token usage: {str(e)}")
+        return {'prompt_tokens': 0, 'completion_tokens': 0, 'estimated': True}
+
+def record_usage(usage, model=CHAT_MODEL):
+    """Add one completion to the process totals and return its cost"""
+    cost = calculate_cost(usage['prompt_tokens'], usage['completion_tokens'], model)
+    metrics.increment('chat_completions')
+    metrics.increment('chat_prompt_tokens', usage['prompt_tokens'])
+    metrics.increment('chat_completion_tokens', usage['completion_tokens'])
+    metrics.increment('chat_cost_usd', cost)
+    if usage['estimated']:
+        metrics.increment('chat_usage_estimated')
+    return cost
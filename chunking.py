@@ -0,0 +1,39 @@
+"""
+Split documents into overlapping word windows so every part of a long page gets its own vector.
+Embedding models truncate their input (all-MiniLM-L6-v2 at 256 tokens), so whole-document
+vectors only ever see the first few paragraphs.
+"""
+
+import re
+
+WORD_RE = re.compile(r'\S+')
+
+def chunk_text(text, window=180, overlap=40):
+    """Split text into windows of `window` words, each sharing `overlap` words with the previous one.
+
+    Returns a list of dicts with the passage text and its character offsets in text.
+    """
+    if window <= 0:
+        raise ValueError("window must be positive")
+    if not 0 <= overlap < window:
+        raise ValueError("overlap must be between 0 and window - 1")
+
+    spans = [match.span() for match in WORD_RE.finditer(text)]
+    chunks = []
+    step = window - overlap
+    for first in range(0, len(spans), step):
+        last = min(first + window, len(spans))
+        start, end = spans[first][0], spans[last - 1][1]
+        chunks.append({
+            'chunk_index': len(chunks),
+            'chunk_start': start,
+            'chunk_end': end,
+            'content': text[start:end]
+        })
+        if last == len(spans):
+            break
+    return chunks
+
+def chunking_id(window, overlap):
+    """Identifier stored with each record so changed chunk settings trigger re-embedding"""
+    return f"{window}/{overlap}" if window else None
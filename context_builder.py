@@ -0,0 +1,152 @@
+"""
+Token-budgeted prompt assembly for Chat.
+
+Passages from the search results are merged where they overlap, deduplicated, and packed best
+first into the token budget left after the instructions and the question. Recent history gets
+its own share of the budget, newest messages first. Token counts use tiktoken.
+"""
+
+import hashlib
+import os
+from functools import lru_cache
+
+CHAT_MODEL = "gpt-4o-mini"
+# Tokens for the whole prompt (system message, history and question), not the answer
+CONTEXT_TOKEN_BUDGET = int(os.getenv('DOCUSEARCH_CONTEXT_TOKENS', '3000'))
+HISTORY_SHARE = float(os.getenv('DOCUSEARCH_HISTORY_SHARE', '0.25'))
+MAX_PASSAGE_TOKENS = 600
+# Don't bother including a passage cut shorter than this
+MIN_PASSAGE_TOKENS = 40
+# Per-message framing tokens added by the chat format, plus the tokens priming the reply
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_OVERHEAD_TOKENS = 3
+
+@lru_cache(maxsize=None)
+def get_encoding(model=CHAT_MODEL):
+    """tiktoken encoding for model, loaded once per process"""
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text, model=CHAT_MODEL):
+    return len(get_encoding(model).encode(text))
+
+def count_message_tokens(messages, model=CHAT_MODEL):
+    """Prompt tokens the API will bill for messages"""
+    return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"], model)
+               for message in messages) + REPLY_OVERHEAD_TOKENS
+
+def truncate_tokens(text, max_tokens, model=CHAT_MODEL):
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def merge_passages(search_results):
+    """Passages from all results, best first, with overlapping windows of a document merged
+    and repeated text removed. Each passage keeps the rank of the document it came from.
+    """
+    candidates = []
+    for rank, result in enumerate(search_results):
+        source = result.get('source_url') or result.get('file_path', 'Unknown')
+        for passage in result.get('passages') or [result]:
+            candidates.append(dict(passage, rank=rank, source=source, file_path=result.get('file_path')))
+    candidates.sort(key=lambda passage: -passage.get('similarity', 0.0))
+
+    merged = []
+    seen_text = set()
+    for passage in candidates:
+        text_key = hashlib.sha256(" ".join(passage['content'].split()).encode('utf-8')).digest()
+        if text_key in seen_text:
+            continue
+        seen_text.add(text_key)
+
+        start, end = passage.get('chunk_start'), passage.get('chunk_end')
+        target = None
+        if start is not None and end is not None:
+            target = next((other for other in merged
+                           if other['file_path'] == passage['file_path'] and other.get('chunk_start') is not None
+                           and start <= other['chunk_end'] and other['chunk_start'] <= end), None)
+        if target is None:
+            merged.append(passage)
+            continue
+
+        # Overlapping windows of the same document become one span (content is text[start:end])
+        if start < target['chunk_start']:
+            target['content'] = passage['content'][:target['chunk_start'] - start] + target['content']
+            target['chunk_start'] = start
+        if end > target['chunk_end']:
+            target['content'] += passage['content'][len(passage['content']) - (end - target['chunk_end']):]
+            target['chunk_end'] = end
+    return merged
+
+def build_chat_messages(instructions, search_results, chat_history, query,
+                        budget=CONTEXT_TOKEN_BUDGET, model=CHAT_MODEL, max_history=6):
+    """Chat messages that fit in budget prompt tokens, and a summary of what was packed.
+
+    Returns (messages, info); info has prompt_tokens, context_tokens, history_tokens,
+    passages_used, passages_dropped and sources (documents that made it into the prompt).
+    """
+    header = f"{instructions}\n\nDocumentation:\n"
+    fixed = count_message_tokens([{"content": header}, {"content": query}], model)
+    remaining = max(budget - fixed, 0)
+
+    # Callers may already have appended the question to the history; don't send it twice
+    if chat_history and chat_history[-1]["role"] == "user" and chat_history[-1]["content"] == query:
+        chat_history = chat_history[:-1]
+
+    # History, newest first, up to its share of the budget
+    history = []
+    history_tokens = 0
+    history_budget = int(remaining * HISTORY_SHARE)
+    for message in reversed(chat_history[-max_history:] if max_history else []):
+        tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"], model)
+        if history_tokens + tokens > history_budget:
+            break
+        history.insert(0, {"role": message["role"], "content": message["content"]})
+        history_tokens += tokens
+    remaining -= history_tokens
+
+    # Passages, best first; the last one is cut to what is left
+    passages = merge_passages(search_results)
+    selected = []
+    context_tokens = 0
+    included = set()
+    for passage in passages:
+        # Document heading the first time a document appears, a separator after that
+        if passage['rank'] in included:
+            framing = count_tokens("\n...\n", model)
+        else:
+            framing = count_tokens(f"\n\nDocument: {passage['source']}\nContent: ", model)
+        room = min(remaining - context_tokens - framing, MAX_PASSAGE_TOKENS)
+        if room < MIN_PASSAGE_TOKENS:
+            break
+        content = truncate_tokens(passage['content'], room, model)
+        selected.append(dict(passage, content=content))
+        included.add(passage['rank'])
+        context_tokens += framing + count_tokens(content, model)
+
+    # Group by document in search rank order, passages in document order
+    documents = {}
+    for passage in sorted(selected, key=lambda p: (p['rank'], p.get('chunk_start') or 0)):
+        documents.setdefault(passage['rank'], []).append(passage)
+    context = ""
+    sources = []
+    for group in documents.values():
+        context += f"\n\nDocument: {group[0]['source']}\nContent: " + "\n...\n".join(p['content'] for p in group)
+        sources.append({'source': group[0]['source'], 'file_path': group[0]['file_path'] or 'Unknown'})
+
+    messages = [{"role": "system", "content": header + context}] + history + [{"role": "user", "content": query}]
+    info = {
+        'prompt_tokens': count_message_tokens(messages, model),
+        'context_tokens': context_tokens,
+        'history_tokens': history_tokens,
+        'history_messages': len(history),
+        'passages_used': len(selected),
+        'passages_dropped': len(passages) - len(selected),
+        'sources': sources
+    }
+    return messages, info
@@ -1,9 +1,5 @@
-try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-import torch
 import os
+import sys
 import json
 from tqdm import tqdm
 import numpy as np
@@ -11,6 +7,16 @@ from pathlib import Path
 import requests
 import warnings
 import urllib3
+import model_registry
+from embedding_store import is_store_path, save_embedding_store, load_embedding_store
+from search_index import as_search_index
+from embedding_pipeline import (
+    collect_text_files, embed_documents, split_documents, plan_incremental_update, merge_incremental_update
+)
+from chunking import chunking_id
+from bm25_index import build_bm25_index, bm25_path_for
+from query_cache import get_query_cache
+from startup_profile import timed_import, import_torch
 
 # Disable SSL verification warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -20,9 +26,21 @@ os.environ['CURL_CA_BUNDLE'] = ""
 os.environ['REQUESTS_CA_BUNDLE'] = ""
 os.environ['TRANSFORMERS_OFFLINE'] = "1"  # First download will be with SSL disabled, then use offline mode
 
+DEFAULT_MODEL = "hkunlp/instructor-xl"
+# Passage window in words; chunk_size=None embeds whole documents
+DEFAULT_CHUNK_SIZE = 350
+DEFAULT_CHUNK_OVERLAP = 50
+
 class EmbeddingProcessor:
-    def __init__(self, model_name="hkunlp/instructor-xl"):
+    def __init__(self, model_name=DEFAULT_MODEL):
         # Initialize the embedding model
+        self.model_name = model_name
+        # Deferred so importing this module (e.g. for load_embeddings) doesn't load torch and langchain
+        try:
+            HuggingFaceEmbeddings = timed_import('langchain_huggingface').HuggingFaceEmbeddings
+        except ImportError:
+            HuggingFaceEmbeddings = timed_import('langchain_community.embeddings').HuggingFaceEmbeddings
+        torch = import_torch()
         device = "cuda" if torch.cuda.is_available() else "cpu"
         
         self.embeddings = HuggingFaceEmbeddings(
@@ -32,64 +50,86 @@ class EmbeddingProcessor:
             },
             encode_kwargs={'normalize_embeddings': True},
         )
+        # The SentenceTransformer itself (`_client` in langchain_huggingface, `client` in langchain_community)
+        self.model = getattr(self.embeddings, '_client', None) or self.embeddings.client
     
     def create_embedding(self, text):
         return self.embeddings.embed_query(text)
 
-def process_text_files(input_folder, output_file, batch_size=32):
-    processor = EmbeddingProcessor()
-    embeddings_data = []
-    current_batch = []
+    def create_embeddings(self, texts, batch_size=32):
+        # Encode through the underlying SentenceTransformer with a per-call batch size: the
+        # processor is shared process-wide, so encode_kwargs must not be changed per call.
+        # Newlines are replaced as embed_documents does, so vectors match embed_query's
+        texts = [text.replace("\n", " ") for text in texts]
+        return self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True).tolist()
+
+def get_processor(model_name=DEFAULT_MODEL):
+    """Return the process-wide EmbeddingProcessor for model_name, loading it on first use"""
+    return model_registry.get_model(
+        ("EmbeddingProcessor", model_name),
+        lambda: EmbeddingProcessor(model_name)
+    )
+
+def warm_up(model_name=DEFAULT_MODEL):
+    """Start loading the model in the background"""
+    return model_registry.warm_up(
+        ("EmbeddingProcessor", model_name),
+        lambda: EmbeddingProcessor(model_name)
+    )
+
+def encode_query(query, model_name=DEFAULT_MODEL):
+    """Query embedding from the shared cache; the model only runs (and loads) on a miss"""
+    return get_query_cache().get_or_compute(
+        model_name, query, lambda: get_processor(model_name).create_embedding(query)
+    )
+
+def process_text_files(input_folder, output_file, batch_size=32, sort_by_length=True, incremental=False,
+                       chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+    # The model is loaded only if something needs embedding
+    model_id = DEFAULT_MODEL
+    chunking = chunking_id(chunk_size, chunk_overlap)
+    
+    # Read every document first so they can be grouped into batches
+    documents = collect_text_files(input_folder)
+    print(f"Found {len(documents)} documents in {input_folder}")
     
-    # Get total number of files for progress bar
-    total_files = sum(1 for _, _, files in os.walk(input_folder) 
-                     for file in files if file.endswith('.txt'))
+    # In incremental mode only new or changed files are embedded again
+    kept, to_embed, deleted = {}, documents, []
+    if incremental and os.path.exists(output_file):
+        existing_data = load_embeddings(output_file)
+        kept, to_embed, deleted = plan_incremental_update(documents, existing_data, model_id, chunking)
+        del existing_data  # Release the old file before it is overwritten
+        print(f"Incremental update: {len(kept)} unchanged, {len(to_embed)} new or changed, {len(deleted)} deleted")
+        # Nothing added, changed or removed: leave the embeddings and BM25 index untouched
+        if kept and not to_embed and not deleted and os.path.exists(bm25_path_for(output_file)):
+            print(f"{output_file} is up to date")
+            return
     
-    with tqdm(total=total_files, desc="Processing files") as pbar:
-        # Walk through all directories in the input folder
-        for root, _, files in os.walk(input_folder):
-            for file in files:
-                if file.endswith('.txt'):
-                    file_path = os.path.join(root, file)
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            # Read the entire content
-                            lines = f.readlines()
-                            
-                            # Extract source URL if it exists
-                            source_url = None
-                            content_start = 0
-                            if lines and lines[0].startswith("Source URL:"):
-                                source_url = lines[0].replace("Source URL:", "").strip()
-                                content_start = 2  # Skip the URL line and the blank line
-                            
-                            # Join the remaining lines for the content
-                            content = "".join(lines[content_start:]).strip()
-                            
-                            if content:
-                                # Create embedding
-                                embedding = processor.create_embedding(content)
-                                
-                                # Store the data
-                                embeddings_data.append({
-                                    'file_path': os.path.relpath(file_path, input_folder),
-                                    'source_url': source_url,
-                                    'embedding': embedding,
-                                    'content': content
-                                })
-                                
-                                pbar.update(1)
-                    
-                    except Exception as e:
-                        print(f"Error processing {file_path}: {str(e)}")
-                        pbar.update(1)
+    # Embed overlapping passages so text past the model's token limit is still searchable
+    if chunk_size:
+        to_embed = split_documents(to_embed, chunk_size, chunk_overlap)
+    
+    # Encode batch_size texts per forward pass
+    new_data = []
+    if to_embed:
+        new_data = embed_documents(get_processor(model_id), to_embed, batch_size=batch_size,
+                                   sort_by_length=sort_by_length, model_id=model_id)
+    embeddings_data = merge_incremental_update(documents, kept, new_data) if kept else new_data
     
     # Save embeddings to file
     save_embeddings(embeddings_data, output_file)
     print(f"\nProcessing complete! Saved {len(embeddings_data)} embeddings to {output_file}")
+    
+    # Lexical index over the same rows, for hybrid BM25 + dense search
+    build_bm25_index(embeddings_data, output_file)
+    print(f"Saved BM25 index to {bm25_path_for(output_file)}")
 
 def save_embeddings(embeddings_data, output_file):
+    # Binary stores keep vectors in a memory-mappable matrix
+    if is_store_path(output_file):
+        save_embedding_store(embeddings_data, output_file)
+        return
+
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
@@ -98,6 +138,8 @@ def save_embeddings(embeddings_data, output_file):
         json.dump(embeddings_data, f)
 
 def load_embeddings(output_file):
+    if is_store_path(output_file):
+        return load_embedding_store(output_file)
     with open(output_file, 'r', encoding='utf-8') as f:
         data = json.load(f)
     # Convert lists to numpy arrays for similarity calculations
@@ -106,40 +148,19 @@ def load_embeddings(output_file):
     return data
 
 def search_embeddings(query, embeddings_data, top_k=5):
-    # Initialize the embedding processor
-    processor = EmbeddingProcessor()
-    
-    # Create query embedding
-    query_embedding = np.array(processor.create_embedding(query))  # Convert to numpy array
-    
-    # Convert embeddings to numpy array for faster computation
-    embeddings = np.array([data['embedding'] for data in embeddings_data])
-    
-    # Calculate cosine similarity
-    similarities = np.dot(embeddings, query_embedding) / (
-        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query_embedding)
-    )
-    
-    # Get top k results
-    top_indices = np.argsort(similarities)[-top_k:][::-1]
-    
-    results = []
-    for idx in top_indices:
-        results.append({
-            'similarity': float(similarities[idx]),
-            'content': embeddings_data[idx]['content'],
-            'source_url': embeddings_data[idx]['source_url'],
-            'file_path': embeddings_data[idx]['file_path']
-        })
+    """Search a SearchIndex (or a list from load_embeddings) using cosine similarity"""
+    # Create query embedding (cached across Search, Chat and the CLI)
+    query_embedding = encode_query(query)
     
-    return results
+    # The index holds the stacked, pre-normalized matrix so nothing is rebuilt per query
+    return as_search_index(embeddings_data).search(query_embedding, top_k, query_text=query)
 
 if __name__ == "__main__":
     input_folder = "extracted_content"  # Your folder with extracted text files
     output_file = "embeddings/embeddings.json"  # Where to save the embeddings
     
-    # Create embeddings
-    process_text_files(input_folder, output_file)
+    # Create embeddings (--incremental re-embeds only new or changed files)
+    process_text_files(input_folder, output_file, incremental="--incremental" in sys.argv)
     
     # Example search
     embeddings_data = load_embeddings(output_file)
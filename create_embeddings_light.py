@@ -1,5 +1,5 @@
-import torch
 import os
+import sys
 import json
 from tqdm import tqdm
 import numpy as np
@@ -7,7 +7,16 @@ from pathlib import Path
 import requests
 import warnings
 import urllib3
-from sentence_transformers import SentenceTransformer
+import model_registry
+from embedding_store import is_store_path, save_embedding_store, load_embedding_store
+from search_index import as_search_index
+from embedding_pipeline import (
+    collect_text_files, embed_documents, split_documents, plan_incremental_update, merge_incremental_update
+)
+from chunking import chunking_id
+from bm25_index import build_bm25_index, bm25_path_for
+from query_cache import get_query_cache
+from startup_profile import timed_import, import_torch
 
 # Disable SSL verification warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -16,11 +25,21 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 os.environ['CURL_CA_BUNDLE'] = ""
 os.environ['REQUESTS_CA_BUNDLE'] = ""
 
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# Passage window in words; chunk_size=None embeds whole documents
+DEFAULT_CHUNK_SIZE = 180
+DEFAULT_CHUNK_OVERLAP = 40
+
 class LightEmbeddingProcessor:
-    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, model_name=DEFAULT_MODEL):
         # Force CPU usage for Railway deployment
+        self.model_name = model_name
         device = "cpu"
         
+        # torch and sentence-transformers are imported here, the first time a model is needed
+        import_torch()
+        SentenceTransformer = timed_import('sentence_transformers').SentenceTransformer
+        
         # Use the smallest available model for minimal size
         self.model = SentenceTransformer(model_name, device=device)
         
@@ -32,63 +51,81 @@ class LightEmbeddingProcessor:
     
     def create_embedding(self, text):
         # Ensure we're using CPU
-        with torch.no_grad():
+        with timed_import('torch').no_grad():
             return self.model.encode(text, convert_to_tensor=False).tolist()
 
-def process_text_files(input_folder, output_file, batch_size=32):
-    processor = LightEmbeddingProcessor()
-    embeddings_data = []
-    current_batch = []
+    def create_embeddings(self, texts, batch_size=32):
+        # Encode a list of texts in one call so the model sees full batches
+        with timed_import('torch').no_grad():
+            return self.model.encode(texts, batch_size=batch_size, convert_to_tensor=False).tolist()
+
+def get_processor(model_name=DEFAULT_MODEL):
+    """Return the process-wide LightEmbeddingProcessor for model_name, loading it on first use"""
+    return model_registry.get_model(
+        ("LightEmbeddingProcessor", model_name),
+        lambda: LightEmbeddingProcessor(model_name)
+    )
+
+def warm_up(model_name=DEFAULT_MODEL):
+    """Start loading the model in the background"""
+    return model_registry.warm_up(
+        ("LightEmbeddingProcessor", model_name),
+        lambda: LightEmbeddingProcessor(model_name)
+    )
+
+def encode_query(query, model_name=DEFAULT_MODEL):
+    """Query embedding from the shared cache; the model only runs (and loads) on a miss"""
+    return get_query_cache().get_or_compute(
+        model_name, query, lambda: get_processor(model_name).create_embedding(query)
+    )
+
+def process_text_files(input_folder, output_file, batch_size=32, sort_by_length=True, incremental=False,
+                       chunk_size=DEFAULT_CHUNK_SIZE, chunk_overlap=DEFAULT_CHUNK_OVERLAP):
+    # The model is loaded only if something needs embedding
+    model_id = DEFAULT_MODEL
+    chunking = chunking_id(chunk_size, chunk_overlap)
+    
+    # Read every document first so they can be grouped into batches
+    documents = collect_text_files(input_folder)
+    print(f"Found {len(documents)} documents in {input_folder}")
     
-    # Get total number of files for progress bar
-    total_files = sum(1 for _, _, files in os.walk(input_folder) 
-                     for file in files if file.endswith('.txt'))
+    # In incremental mode only new or changed files are embedded again
+    kept, to_embed, deleted = {}, documents, []
+    if incremental and os.path.exists(output_file):
+        existing_data = load_embeddings(output_file)
+        kept, to_embed, deleted = plan_incremental_update(documents, existing_data, model_id, chunking)
+        del existing_data  # Release the old file before it is overwritten
+        print(f"Incremental update: {len(kept)} unchanged, {len(to_embed)} new or changed, {len(deleted)} deleted")
+        # Nothing added, changed or removed: leave the embeddings and BM25 index untouched
+        if kept and not to_embed and not deleted and os.path.exists(bm25_path_for(output_file)):
+            print(f"{output_file} is up to date")
+            return
     
-    with tqdm(total=total_files, desc="Processing files") as pbar:
-        # Walk through all directories in the input folder
-        for root, _, files in os.walk(input_folder):
-            for file in files:
-                if file.endswith('.txt'):
-                    file_path = os.path.join(root, file)
-                    
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            # Read the entire content
-                            lines = f.readlines()
-                            
-                            # Extract source URL if it exists
-                            source_url = None
-                            content_start = 0
-                            if lines and lines[0].startswith("Source URL:"):
-                                source_url = lines[0].replace("Source URL:", "").strip()
-                                content_start = 2  # Skip the URL line and the blank line
-                            
-                            # Join the remaining lines for the content
-                            content = "".join(lines[content_start:]).strip()
-                            
-                            if content:
-                                # Create embedding
-                                embedding = processor.create_embedding(content)
-                                
-                                # Store the data
-                                embeddings_data.append({
-                                    'file_path': os.path.relpath(file_path, input_folder),
-                                    'source_url': source_url,
-                                    'embedding': embedding,
-                                    'content': content
-                                })
-                                
-                                pbar.update(1)
-                    
-                    except Exception as e:
-                        print(f"Error processing {file_path}: {str(e)}")
-                        pbar.update(1)
+    # Embed overlapping passages so text past the model's token limit is still searchable
+    if chunk_size:
+        to_embed = split_documents(to_embed, chunk_size, chunk_overlap)
+    
+    # Encode batch_size texts per forward pass
+    new_data = []
+    if to_embed:
+        new_data = embed_documents(get_processor(model_id), to_embed, batch_size=batch_size,
+                                   sort_by_length=sort_by_length, model_id=model_id)
+    embeddings_data = merge_incremental_update(documents, kept, new_data) if kept else new_data
     
     # Save embeddings to file
     save_embeddings(embeddings_data, output_file)
     print(f"\nProcessing complete! Saved {len(embeddings_data)} embeddings to {output_file}")
+    
+    # Lexical index over the same rows, for hybrid BM25 + dense search
+    build_bm25_index(embeddings_data, output_file)
+    print(f"Saved BM25 index to {bm25_path_for(output_file)}")
 
 def save_embeddings(embeddings_data, output_file):
+    # Binary stores keep vectors in a memory-mappable matrix
+    if is_store_path(output_file):
+        save_embedding_store(embeddings_data, output_file)
+        return
+
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     
@@ -97,8 +134,10 @@ def save_embeddings(embeddings_data, output_file):
         json.dump(embeddings_data, f)
 
 def load_embeddings(output_file):
-    """Load embeddings from file"""
+    """Load embeddings from a JSON file or binary store"""
     try:
+        if is_store_path(output_file):
+            return load_embedding_store(output_file)
         with open(output_file, 'r', encoding='utf-8') as f:
             return json.load(f)
     except FileNotFoundError:
@@ -109,16 +148,27 @@ def load_embeddings(output_file):
         return []
 
 def search_embeddings(query, embeddings_data, top_k=5):
-    """Search embeddings using cosine similarity"""
+    """Search a SearchIndex (or a list from load_embeddings) using cosine similarity"""
     if not embeddings_data:
         return []
     
-    # Initialize the embedding processor
-    processor = LightEmbeddingProcessor()
+    # Create query embedding (cached across Search, Chat and the CLI)
+    query_embedding = encode_query(query)
     
-    # Create query embedding
-    query_embedding = processor.create_embedding(query)
+    # One matrix-vector product against the prebuilt, normalized document matrix
+    return as_search_index(embeddings_data).search(query_embedding, top_k, query_text=query)
+
+def search_embeddings_reference(query, embeddings_data, top_k=5):
+    """Per-item cosine similarity loop, kept as the reference for equality checks against search_embeddings"""
+    if not embeddings_data:
+        return []
     
+    # Create query embedding (cached across Search, Chat and the CLI)
+    query_embedding = encode_query(query)
+    return rank_reference(query_embedding, embeddings_data, top_k)
+
+def rank_reference(query_embedding, embeddings_data, top_k=5):
+    """Top_k of a plain list of records (each with its 'embedding'), scored one item at a time"""
     # Calculate similarities
     similarities = []
     for item in embeddings_data:
@@ -146,6 +196,7 @@ if __name__ == "__main__":
     output_file = "embeddings/embeddings_light.json"
     
     if os.path.exists(input_folder):
-        process_text_files(input_folder, output_file)
+        # --incremental re-embeds only new or changed files
+        process_text_files(input_folder, output_file, incremental="--incremental" in sys.argv)
     else:
         print(f"Input folder not found: {input_folder}")
\ No newline at end of file
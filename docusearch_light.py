@@ -1,12 +1,11 @@
+# Starts the startup clock, so keep it first
+import startup_profile
 import streamlit as st
 import json
 import numpy as np
 import os
 import warnings
-import torch
 import base64
-from openai import OpenAIError, AuthenticationError, PermissionDeniedError
-import tiktoken
 from pathlib import Path
 import sys
 
@@ -15,16 +14,45 @@ current_file = Path(__file__).resolve()
 parent_directory = current_file.parent
 sys.path.append(str(parent_directory))
 
-# Import the lighter embedding functions
-try:
-    from create_embeddings_light import search_embeddings, load_embeddings
-except ImportError:
-    # Fallback to original if light version not available
-    from create_embeddings import search_embeddings, load_embeddings
+# "dense" searches sentence-transformer embeddings; "tfidf" uses the prebuilt sparse index and never imports torch
+SEARCH_BACKEND = os.getenv('DOCUSEARCH_BACKEND', 'dense')
+
+if SEARCH_BACKEND == 'tfidf':
+    from tfidf_search import search_embeddings, load_embeddings, warm_up
+    # No query embeddings, so the semantic answer cache is off
+    encode_query = None
+else:
+    # Import the lighter embedding functions
+    try:
+        from create_embeddings_light import search_embeddings, load_embeddings, warm_up, encode_query
+    except ImportError:
+        # Fallback to original if light version not available
+        from create_embeddings import search_embeddings, load_embeddings, warm_up, encode_query
+import model_registry
+import metrics
+from openai_utils import (
+    test_network_connectivity, validate_openai_key, validate_openai_key_async, invalidate_openai_key,
+    get_openai_client, stream_chat_completion
+)
+from search_index import get_search_index
+import health_server
+from query_cache import get_query_cache
+from answer_cache import get_answer_cache, hash_context
+from context_builder import build_chat_messages
+from chat_costs import usage_from_response, record_usage
+
+startup_profile.checkpoint("app imports")
+
+# Persistent caches (semantic answer cache) live here
+cache_directory = os.getenv('DOCUSEARCH_CACHE_DIR', os.path.join(parent_directory, "cache"))
 
 # Set Streamlit to wide mode
 st.set_page_config(layout="wide")
 
+# Probe endpoints on their own port when the app is started directly with `streamlit run`
+if os.getenv('DOCUSEARCH_HEALTH_PORT'):
+    health_server.start_health_server()
+
 # Health check for Railway
 if os.getenv('RAILWAY_HEALTH_CHECK'):
     st.write("OK")
@@ -36,44 +64,6 @@ warnings.filterwarnings("ignore", category=DeprecationWarning, module="sentence_
 warnings.filterwarnings("ignore", message="Examining the path of torch.classes raised")
 warnings.filterwarnings("ignore", message="Unsupported Windows version")
 
-# Monkey patch torch.classes to avoid the warning
-torch.classes = type('dummy', (), {'__getattr__': lambda self, attr: None})()
-
-def test_network_connectivity():
-    """Test basic network connectivity"""
-    try:
-        import requests
-        response = requests.get("https://api.openai.com", timeout=5)
-        return True, "Network connectivity OK"
-    except requests.exceptions.ConnectionError:
-        return False, "No internet connection"
-    except requests.exceptions.Timeout:
-        return False, "Network timeout"
-    except Exception as e:
-        return False, f"Network error: {str(e)}"
-
-def validate_openai_key(api_key):
-    """Test if the OpenAI API key is valid and working"""
-    if not api_key or api_key == "your-openai-api-key-here":
-        return False, "Please enter a valid OpenAI API key"
-    
-    # First test network connectivity
-    network_ok, network_msg = test_network_connectivity()
-    if not network_ok:
-        return False, network_msg
-    
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key, timeout=10.0)
-        # Try a simple test call
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": "Hello"}],
-            max_tokens=5
-        )
-        return True, "API key is valid"
-    except Exception as e:
-        return False, f"API key validation failed: {str(e)}"
 
 # Try to load OpenAI API key from config file or environment variable
 project_api_key = None
@@ -109,41 +99,54 @@ if not project_api_key:
         help="You can also set the OPENAI_API_KEY environment variable or create an openai_config.json file with your API key"
     )
 
-# Add API key validation in sidebar
+# Validate the API key in the background; results are cached per key across reruns
 if project_api_key:
-    is_valid, validation_msg = validate_openai_key(project_api_key)
-    if is_valid:
-        st.sidebar.success("✅ API key is valid")
+    validation = validate_openai_key_async(project_api_key)
+    if validation is None:
+        st.sidebar.info("⏳ Checking API key...")
     else:
-        st.sidebar.error(f"❌ {validation_msg}")
-        if "your-openai-api-key-here" in project_api_key:
-            st.sidebar.info("💡 Please replace 'your-openai-api-key-here' with your actual API key")
+        is_valid, validation_msg = validation
+        if is_valid:
+            st.sidebar.success("✅ API key is valid")
+        else:
+            st.sidebar.error(f"❌ {validation_msg}")
+            if "your-openai-api-key-here" in project_api_key:
+                st.sidebar.info("💡 Please replace 'your-openai-api-key-here' with your actual API key")
         
-        # Add troubleshooting help
-        with st.sidebar.expander("🔧 Troubleshooting"):
-            st.markdown("""
-            **Common issues:**
+            # Add troubleshooting help
+            with st.sidebar.expander("🔧 Troubleshooting"):
+                st.markdown("""
+                **Common issues:**
             
-            1. **No internet connection** - Check your network
-            2. **Invalid API key** - Get a new key from [OpenAI](https://platform.openai.com/api-keys)
-            3. **Rate limits** - Wait a moment and try again
-            4. **Quota exceeded** - Check your OpenAI account balance
-            5. **Corporate firewall** - Contact your IT department
+                1. **No internet connection** - Check your network
+                2. **Invalid API key** - Get a new key from [OpenAI](https://platform.openai.com/api-keys)
+                3. **Rate limits** - Wait a moment and try again
+                4. **Quota exceeded** - Check your OpenAI account balance
+                5. **Corporate firewall** - Contact your IT department
             
-            **Test your connection:**
-            """)
-            if st.button("Test Network"):
-                network_ok, network_msg = test_network_connectivity()
-                if network_ok:
-                    st.success(network_msg)
-                else:
-                    st.error(network_msg)
-
-@st.cache_data
+                **Test your connection:**
+                """)
+                if st.button("Test Network"):
+                    network_ok, network_msg = test_network_connectivity()
+                    if network_ok:
+                        st.success(network_msg)
+                    else:
+                        st.error(network_msg)
+
+# cache_resource keeps one shared copy; cache_data would pickle the memory-mapped vectors into RAM
+@st.cache_resource
 def load_embeddings_data():
+    if SEARCH_BACKEND == 'tfidf':
+        return load_tfidf_data()
+
     # Try multiple possible paths for embeddings file
     embeddings_files = [
-        "embeddings_light.json",              # Main directory (preferred)
+        "embeddings_light.store",             # Binary store (memory-mapped, preferred)
+        "embeddings/embeddings_light.store",
+        os.path.join(parent_directory, "embeddings_light.store"),
+        os.path.join(parent_directory, "embeddings", "embeddings_light.store"),
+        "/app/embeddings/embeddings_light.store",  # Railway Docker path
+        "embeddings_light.json",              # Main directory
         "embeddings.json",                    # Main directory
         "embeddings/embeddings_light.json",   # Current directory
         "embeddings/embeddings.json",         # Current directory
@@ -165,7 +168,10 @@ def load_embeddings_data():
         if os.path.exists(embeddings_file):
             try:
                 st.info(f"Loading embeddings from: {embeddings_file}")
-                return load_embeddings(embeddings_file)
+                # Shared with the start-up warm-up in start_app.py, so the index is only loaded once
+                index = get_search_index(embeddings_file, load_embeddings)
+                health_server.mark_index_loaded(index)
+                return index
             except Exception as e:
                 st.warning(f"Failed to load {embeddings_file}: {str(e)}")
                 continue
@@ -206,6 +212,27 @@ def load_embeddings_data():
     
     st.stop()
 
+def load_tfidf_data():
+    tfidf_paths = [
+        os.getenv('DOCUSEARCH_TFIDF_INDEX', ''),
+        "embeddings/embeddings_light.tfidf",
+        os.path.join(parent_directory, "embeddings", "embeddings_light.tfidf"),
+        "/app/embeddings/embeddings_light.tfidf"  # Railway Docker path
+    ]
+    for tfidf_path in tfidf_paths:
+        if tfidf_path and os.path.isdir(tfidf_path):
+            try:
+                st.info(f"Loading TF-IDF index from: {tfidf_path}")
+                index = load_embeddings(tfidf_path)
+                health_server.mark_index_loaded(index)
+                return index
+            except Exception as e:
+                st.warning(f"Failed to load {tfidf_path}: {str(e)}")
+    
+    st.error("❌ No TF-IDF index found!")
+    st.error("Build one with: python tfidf_search.py embeddings/embeddings_light.json")
+    st.stop()
+
 def search_database(query, embeddings_data, k=5):
     results = search_embeddings(query, embeddings_data, top_k=k)
     return results
@@ -240,105 +267,113 @@ def create_download_button(source, key_prefix):
     
     st.warning(f"Source file not found: {source}")
 
-def get_chat_response(query, chat_history, embeddings_data):
+def make_source_docs(sources):
+    """Convert sources to Document format for compatibility"""
+    source_docs = []
+    for source in sources:
+        # Create a simple document object without langchain
+        doc = type('Document', (), {
+            'page_content': "Source document",
+            'metadata': source
+        })()
+        source_docs.append(doc)
+    return source_docs
+
+def get_chat_response(query, chat_history, embeddings_data, stream_placeholder=None):
     if not project_api_key:
-        return "Please enter your OpenAI API key in the sidebar to enable chat functionality.", []
+        return "Please enter your OpenAI API key in the sidebar to enable chat functionality.", [], {}
     
     try:
-        from openai import OpenAI
         import requests
+        from openai import OpenAIError, AuthenticationError, PermissionDeniedError
         
-        # Search for relevant documents
-        search_results = search_embeddings(query, embeddings_data, top_k=3)
-        
-        # Prepare context from search results
-        context = ""
-        sources = []
-        for result in search_results:
-            context += f"\n\nDocument: {result.get('source_url', result.get('file_path', 'Unknown'))}\nContent: {result['content'][:1000]}"
-            sources.append({
-                'source': result.get('source_url', result.get('file_path', 'Unknown')),
-                'file_path': result.get('file_path', 'Unknown')
-            })
+        # Search for relevant documents; the token budget decides how much of them is sent
+        search_results = search_embeddings(query, embeddings_data, top_k=5)
         
-        # Prepare chat history for the API
-        messages = [
-            {
-                "role": "system",
-                "content": f"You are a helpful assistant that answers questions based on the provided documentation. Use only the information from the documents below to answer questions. If the information is not in the documents, say so.\n\nDocumentation:\n{context}"
-            }
-        ]
-        
-        # Add chat history
-        for message in chat_history[-6:]:  # Keep last 6 messages for context
-            messages.append({
-                "role": message["role"],
-                "content": message["content"]
-            })
-        
-        # Add current query
-        messages.append({
-            "role": "user",
-            "content": query
-        })
+        # Near-duplicates of earlier standalone questions over the same context reuse the stored answer
+        answer_cache, query_embedding, cache_context = None, None, None
+        is_standalone = not any(message["role"] == "assistant" for message in chat_history)
+        if is_standalone and encode_query is not None and getattr(embeddings_data, 'version', None):
+            answer_cache = get_answer_cache(cache_directory, embeddings_data.path, embeddings_data.version)
+            query_embedding = encode_query(query)
+            cache_context = hash_context(search_results)
+            cached = answer_cache.lookup(query_embedding, cache_context)
+            if cached is not None:
+                metrics.increment('answer_cache_hits')
+                return cached['answer'], make_source_docs(cached['sources']), {
+                    'cached': True, 'saved_cost': cached.get('cost', 0.0)
+                }
         
-        # Call OpenAI API with timeout and retry settings
-        client = OpenAI(
-            api_key=project_api_key,
-            timeout=30.0,  # 30 second timeout
-            max_retries=2
+        # Pack the best passages and recent history into the prompt token budget
+        messages, context_info = build_chat_messages(
+            "You are a helpful assistant that answers questions based on the provided documentation. Use only the information from the documents below to answer questions. If the information is not in the documents, say so.",
+            search_results, chat_history, query
         )
+        sources = context_info['sources']
+        # Counted before the call; returned in chat_info for the caption and totalled in the metrics
+        metrics.increment('chat_prompt_tokens_counted', context_info['prompt_tokens'])
+        metrics.increment('chat_passages_dropped', context_info['passages_dropped'])
+        print(f"Chat prompt: {context_info['prompt_tokens']} tokens ({context_info['passages_used']} passages, "
+              f"{context_info['passages_dropped']} dropped, {context_info['history_messages']} history messages)")
         
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0,
-            max_tokens=1000
-        )
+        # Shared client with pooled keep-alive connections (30s timeout, 2 retries by default)
+        client = get_openai_client(project_api_key)
         
-        answer = response.choices[0].message.content
+        if stream_placeholder is None:
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0,
+                max_tokens=1000
+            )
+            
+            answer = response.choices[0].message.content
+            usage = response.usage
+        else:
+            # Stream tokens into the placeholder as they arrive; the full text is still returned
+            answer, usage = stream_chat_completion(client, messages, stream_placeholder)
         
-        # Convert sources to Document format for compatibility
-        source_docs = []
-        for source in sources:
-            # Create a simple document object without langchain
-            doc = type('Document', (), {
-                'page_content': "Source document",
-                'metadata': source
-            })()
-            source_docs.append(doc)
+        # Bill from the API's token counts (system prompt, history and answer included)
+        usage = usage_from_response(usage, messages, answer)
+        cost = record_usage(usage)
         
-        return answer, source_docs
+        # Remember answers to standalone questions for near-duplicates
+        if cache_context is not None and answer:
+            answer_cache.store(query, query_embedding, cache_context, answer, sources, cost=cost)
+        
+        return answer, make_source_docs(sources), dict(context_info, usage=usage, cost=cost)
         
     except ImportError as e:
         st.error(f"Missing required packages: {str(e)}")
-        return "Please install required packages: pip install openai", []
+        return "Please install required packages: pip install openai", [], {}
     except AuthenticationError:
+        # The cached validation is stale; re-check the key on the next rerun
+        invalidate_openai_key(project_api_key)
         st.error("Authentication failed. Please check your OpenAI API key.")
-        return "I'm sorry, but there was an authentication error. Please check your API key.", []
+        return "I'm sorry, but there was an authentication error. Please check your API key.", [], {}
     except PermissionDeniedError:
         st.error("Permission denied. Your API key may not have access to this model.")
-        return "I'm sorry, but I don't have permission to access this feature. Please check your API key.", []
+        return "I'm sorry, but I don't have permission to access this feature. Please check your API key.", [], {}
     except OpenAIError as e:
         error_msg = str(e)
         if "Connection error" in error_msg:
             st.error("Connection error. Please check your internet connection and try again.")
-            return "I'm sorry, but I couldn't connect to OpenAI. Please check your internet connection and try again.", []
+            return "I'm sorry, but I couldn't connect to OpenAI. Please check your internet connection and try again.", [], {}
         elif "rate_limit" in error_msg.lower():
             st.error("Rate limit exceeded. Please wait a moment and try again.")
-            return "I'm sorry, but the API rate limit has been exceeded. Please wait a moment and try again.", []
+            return "I'm sorry, but the API rate limit has been exceeded. Please wait a moment and try again.", [], {}
         elif "quota" in error_msg.lower():
             st.error("API quota exceeded. Please check your OpenAI account.")
-            return "I'm sorry, but your OpenAI API quota has been exceeded. Please check your account.", []
+            return "I'm sorry, but your OpenAI API quota has been exceeded. Please check your account.", [], {}
         else:
             st.error(f"OpenAI API error: {error_msg}")
-            return f"I'm sorry, but I encountered an error: {error_msg}", []
+            return f"I'm sorry, but I encountered an error: {error_msg}", [], {}
     except requests.exceptions.ConnectionError:
         st.error("Network connection error. Please check your internet connection.")
-        return "I'm sorry, but I couldn't connect to the internet. Please check your connection and try again.", []
+        return "I'm sorry, but I couldn't connect to the internet. Please check your connection and try again.", [], {}
     except requests.exceptions.Timeout:
         st.error("Request timed out. Please try again.")
-        return "I'm sorry, but the request timed out. Please try again.", []
+        return "I'm sorry, but the request timed out. Please try again.", [], {}
     except Exception as e:
         st.error(f"Unexpected error: {str(e)}")
         # Fallback to simple search-based response
@@ -350,31 +385,11 @@ def get_chat_response(query, chat_history, embeddings_data):
                     response += f"- {result['content'][:200]}...\n\n"
                     if result.get('source_url'):
                         response += f"Source: {result['source_url']}\n\n"
-                return response, []
+                return response, [], {}
             else:
-                return "I couldn't find relevant information in the documentation for your query.", []
+                return "I couldn't find relevant information in the documentation for your query.", [], {}
         except:
-            return "I'm sorry, but I encountered an unexpected error. Please try again later.", []
-
-def calculate_cost(prompt, response):
-    try:
-        model = "gpt-4o-mini"
-        encoding = tiktoken.encoding_for_model(model)
-        
-        prompt_tokens = len(encoding.encode(prompt))
-        response_tokens = len(encoding.encode(response))
-        
-        # Prices as of October 2024 for gpt-4o-mini
-        input_price_per_1k = 0.000150
-        output_price_per_1k = 0.000600
-        
-        prompt_cost = (prompt_tokens / 1000) * input_price_per_1k
-        response_cost = (response_tokens / 1000) * output_price_per_1k
-        
-        total_cost = prompt_cost + response_cost
-        return total_cost
-    except Exception:
-        return 0.0
+            return "I'm sorry, but I encountered an unexpected error. Please try again later.", [], {}
 
 st.title("[Connections](http://connections/) Chatbot")
 
@@ -392,14 +407,25 @@ if not project_api_key:
 else:
     st.success("✅ API key is configured")
 
-# Load the embeddings
-embeddings_data = load_embeddings_data()
+# Load the search index (built once per process)
+with startup_profile.phase("load search index"):
+    embeddings_data = load_embeddings_data()
 
 # Sidebar for mode selection
 mode = st.sidebar.radio("Choose mode:", ("Chat", "Search", "Documents"))
 
+# Load the embedding model in the background once the page is up; Documents mode never needs it
+if mode != "Documents":
+    warm_up()
+startup_profile.report()
+
 if "total_cost" not in st.session_state:
     st.session_state.total_cost = 0.0
+if "saved_cost" not in st.session_state:
+    st.session_state.saved_cost = 0.0
+if "prompt_tokens" not in st.session_state:
+    st.session_state.prompt_tokens = 0
+    st.session_state.completion_tokens = 0
 
 if mode == "Search":
     # Create a search box
@@ -437,6 +463,8 @@ elif mode == "Chat":
 
     # Display total session cost
     st.sidebar.markdown(f"**Total session cost: ${st.session_state.total_cost:.4f}**")
+    if st.session_state.saved_cost:
+        st.sidebar.markdown(f"**Saved by answer cache: ${st.session_state.saved_cost:.4f}**")
 
     # Accept user input
     if prompt := st.chat_input("What would you like to know about the documents?"):
@@ -446,18 +474,32 @@ elif mode == "Chat":
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Get chat response
-        response, source_docs = get_chat_response(prompt, st.session_state.messages, embeddings_data)
-
-        # Calculate cost
-        cost = calculate_cost(prompt, response)
-        
-        # Update total cost
-        st.session_state.total_cost += cost
-
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
-            st.markdown(response)
+            # Get chat response, rendering tokens as they stream in
+            response_placeholder = st.empty()
+            response, source_docs, chat_info = get_chat_response(
+                prompt, st.session_state.messages, embeddings_data, stream_placeholder=response_placeholder
+            )
+            response_placeholder.markdown(response)
+
+            # Cost from the API usage (answers from the semantic cache cost nothing)
+            cost = chat_info.get('cost', 0.0)
+            if chat_info.get('cached'):
+                st.session_state.saved_cost += chat_info['saved_cost']
+                st.caption(f"💾 Answered from cache, saved ${chat_info['saved_cost']:.4f}")
+            elif chat_info.get('usage'):
+                usage = chat_info['usage']
+                st.session_state.prompt_tokens += usage['prompt_tokens']
+                st.session_state.completion_tokens += usage['completion_tokens']
+                st.caption(f"Tokens: {usage['prompt_tokens']} prompt ({chat_info['prompt_tokens']} counted before "
+                           f"sending: {chat_info['passages_used']} passages, {chat_info['passages_dropped']} dropped, "
+                           f"{chat_info['history_messages']} history messages) + {usage['completion_tokens']} completion"
+                           + (" (estimated)" if usage['estimated'] else ""))
+            
+            # Update total cost
+            st.session_state.total_cost += cost
+
             st.markdown("---")
             st.markdown("**Sources:**")
             
@@ -474,6 +516,8 @@ elif mode == "Chat":
             
             st.markdown(f"**Cost of this interaction: ${cost:.4f}**")
             st.markdown(f"**Total session cost: ${st.session_state.total_cost:.4f}**")
+            if st.session_state.saved_cost:
+                st.markdown(f"**Saved by answer cache this session: ${st.session_state.saved_cost:.4f}**")
 
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
@@ -484,12 +528,13 @@ elif mode == "Chat":
 else:  # Documents mode
     st.subheader("Document List")
     
-    # Display document information from embeddings
-    st.write(f"**Total documents loaded:** {len(embeddings_data)}")
+    # Display document information from embeddings (one entry per document, not per passage)
+    documents = embeddings_data.documents()
+    st.write(f"**Total documents loaded:** {len(documents)}")
     
     # Group documents by directory
     documents_by_dir = {}
-    for item in embeddings_data:
+    for item in documents:
         file_path = item.get('file_path', 'Unknown')
         dir_name = os.path.dirname(file_path) if file_path != 'Unknown' else 'Unknown'
         
@@ -518,4 +563,21 @@ else:  # Documents mode
             st.write(f"... and {len(docs) - 5} more documents")
 
 st.sidebar.markdown("## About")
-st.sidebar.info("This app searches and chats with documents using the 'all-MiniLM-L6-v2' model for embeddings and GPT-4o-mini for chat.")
\ No newline at end of file
+st.sidebar.info("This app searches and chats with documents using the 'all-MiniLM-L6-v2' model for embeddings and GPT-4o-mini for chat.")
+
+# Report how long the resident embedding model took to load
+for model_key, load_seconds in model_registry.loaded_models().items():
+    st.sidebar.caption(f"Embedding model {model_key[1]} loaded in {load_seconds:.1f}s")
+query_cache_stats = get_query_cache().stats()
+st.sidebar.caption(f"Query cache: {query_cache_stats['hits'] + query_cache_stats['disk_hits']} hits, "
+                   f"{query_cache_stats['misses']} misses")
+with st.sidebar.expander("📊 Metrics"):
+    st.markdown("**This session**")
+    st.json({
+        'chat_cost_usd': st.session_state.total_cost,
+        'chat_prompt_tokens': st.session_state.prompt_tokens,
+        'chat_completion_tokens': st.session_state.completion_tokens,
+        'answer_cache_saved_usd': st.session_state.saved_cost
+    })
+    st.markdown("**This process**")
+    st.json(metrics.snapshot())
\ No newline at end of file
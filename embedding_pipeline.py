@@ -0,0 +1,176 @@
+"""
+Shared steps for turning extracted_content/*.txt files into embeddings.
+Used by process_text_files in create_embeddings.py and create_embeddings_light.py.
+"""
+
+import hashlib
+import os
+import time
+from tqdm import tqdm
+
+from chunking import chunk_text, chunking_id
+
+def read_text_file(file_path):
+    """Return (source_url, content) for a file written by extract_content.py"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    # Extract source URL if it exists
+    source_url = None
+    content_start = 0
+    if lines and lines[0].startswith("Source URL:"):
+        source_url = lines[0].replace("Source URL:", "").strip()
+        content_start = 2  # Skip the URL line and the blank line
+
+    # Join the remaining lines for the content
+    content = "".join(lines[content_start:]).strip()
+    return source_url, content
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def collect_text_files(input_folder):
+    """Read every non-empty .txt file under input_folder into a list of documents"""
+    documents = []
+    for root, _, files in os.walk(input_folder):
+        for file in files:
+            if file.endswith('.txt'):
+                file_path = os.path.join(root, file)
+                try:
+                    source_url, content = read_text_file(file_path)
+                except Exception as e:
+                    print(f"Error processing {file_path}: {str(e)}")
+                    continue
+                if content:
+                    documents.append({
+                        'file_path': os.path.relpath(file_path, input_folder),
+                        'source_url': source_url,
+                        'content': content,
+                        'content_hash': content_hash(content)
+                    })
+    return documents
+
+def _embed_batch(processor, batch, batch_size):
+    """Embed one batch, falling back to one document at a time so a bad file doesn't sink the batch"""
+    try:
+        return processor.create_embeddings([doc['content'] for doc in batch], batch_size=batch_size)
+    except Exception as e:
+        print(f"Batch failed ({str(e)}), retrying documents individually")
+
+    embeddings = []
+    for doc in batch:
+        try:
+            embeddings.append(processor.create_embedding(doc['content']))
+        except Exception as e:
+            print(f"Error processing {doc['file_path']}: {str(e)}")
+            embeddings.append(None)
+    return embeddings
+
+def embed_documents(processor, documents, batch_size=32, sort_by_length=True, model_id=None):
+    """Embed documents in batches and return them as embeddings_data records"""
+    if not documents:
+        return []
+
+    order = list(range(len(documents)))
+    if sort_by_length:
+        # Similar-length documents in one batch waste less padding
+        order.sort(key=lambda i: len(documents[i]['content']))
+
+    # After split_documents each item is a passage, so count those
+    unit = "passage" if any('chunk_index' in doc for doc in documents) else "document"
+    embeddings = [None] * len(documents)
+    start = time.perf_counter()
+    with tqdm(total=len(documents), desc=f"Embedding {unit}s", unit=unit) as pbar:
+        for batch_start in range(0, len(order), batch_size):
+            batch_ids = order[batch_start:batch_start + batch_size]
+            batch = [documents[i] for i in batch_ids]
+            for i, embedding in zip(batch_ids, _embed_batch(processor, batch, batch_size)):
+                embeddings[i] = embedding
+
+            pbar.update(len(batch))
+            elapsed = time.perf_counter() - start
+            pbar.set_postfix({f"{unit}s_per_sec": f"{pbar.n / elapsed:.1f}" if elapsed > 0 else "-"})
+
+    elapsed = time.perf_counter() - start
+    if documents and elapsed > 0:
+        print(f"Embedded {len(documents)} {unit}s in {elapsed:.1f}s ({len(documents) / elapsed:.1f} {unit}s/sec)")
+
+    embeddings_data = []
+    for doc, embedding in zip(documents, embeddings):
+        if embedding is None:
+            continue
+        record = {
+            'file_path': doc['file_path'],
+            'source_url': doc['source_url'],
+            'embedding': embedding
+        }
+        # content, content_hash and any chunk fields
+        record.update((key, value) for key, value in doc.items() if key not in record)
+        record['model'] = model_id
+        embeddings_data.append(record)
+    return embeddings_data
+
+def split_documents(documents, chunk_size, chunk_overlap):
+    """Replace each document by its overlapping passages, keeping document and offset per passage"""
+    chunking = chunking_id(chunk_size, chunk_overlap)
+    passages = []
+    for doc in documents:
+        for chunk in chunk_text(doc['content'], chunk_size, chunk_overlap):
+            passage = {key: value for key, value in doc.items() if key != 'content'}
+            passage.update(chunk)
+            passage['chunking'] = chunking
+            passages.append(passage)
+    if documents:
+        print(f"Split {len(documents)} documents into {len(passages)} passages "
+              f"({chunk_size} words, {chunk_overlap} overlap)")
+    return passages
+
+def _embedding_as_list(embedding):
+    return embedding.tolist() if hasattr(embedding, 'tolist') else list(embedding)
+
+def plan_incremental_update(documents, existing_data, model_id, chunking=None):
+    """Split documents into those whose stored embeddings can be kept and those to (re-)embed.
+
+    Returns (kept, to_embed, deleted_paths); kept maps file_path to its existing records.
+    """
+    existing_by_path = {}
+    for item in existing_data:
+        existing_by_path.setdefault(item['file_path'], []).append(item)
+
+    kept = {}
+    to_embed = []
+    for doc in documents:
+        old_records = existing_by_path.get(doc['file_path'])
+        if old_records:
+            old = old_records[0]
+            # Files written before hashes were stored: hash the saved content, and assume
+            # the model is this script's own (it was the only one that ever wrote the file)
+            old_hash = old.get('content_hash') or content_hash(old.get('content') or '')
+            if (old_hash == doc['content_hash'] and old.get('model', model_id) == model_id
+                    and old.get('chunking') == chunking):
+                # Copy vectors out so a memory-mapped store can be closed and rewritten
+                kept[doc['file_path']] = [
+                    dict(item, embedding=_embedding_as_list(item['embedding']),
+                         content_hash=doc['content_hash'], model=item.get('model') or model_id)
+                    for item in old_records
+                ]
+                continue
+        to_embed.append(doc)
+
+    current_paths = {doc['file_path'] for doc in documents}
+    deleted = sorted(path for path in existing_by_path if path not in current_paths)
+    return kept, to_embed, deleted
+
+def merge_incremental_update(documents, kept, new_data):
+    """Combine kept and newly embedded records in input_folder order"""
+    new_by_path = {}
+    for item in new_data:
+        new_by_path.setdefault(item['file_path'], []).append(item)
+
+    embeddings_data = []
+    for doc in documents:
+        if doc['file_path'] in kept:
+            embeddings_data.extend(kept[doc['file_path']])
+        else:
+            embeddings_data.extend(new_by_path.get(doc['file_path'], []))
+    return embeddings_data
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Binary embedding store.
+
+A store is a directory (named *.store) holding:
+    vectors.npy   - contiguous float32/float16 matrix, opened with np.load(mmap_mode='r')
+    content.bin   - UTF-8 document content, concatenated
+    records.jsonl - per-document metadata, one JSON object per line
+    offsets.npy   - row i: byte offsets of document i in content.bin and records.jsonl
+    meta.json     - format version, count, dimension and dtype
+
+All of it is memory-mapped, so resident memory stays flat as the corpus grows: a record's
+content and metadata are decoded only when it is read (e.g. for a search hit). Version 1
+stores, with the metadata inside meta.json, can still be read.
+
+Usage: python embedding_store.py embeddings/embeddings_light.json [output.store] [--dtype float16]
+"""
+
+import argparse
+import json
+import mmap
+import os
+
+import numpy as np
+
+STORE_SUFFIX = ".store"
+FORMAT_VERSION = 2
+VECTORS_FILE = "vectors.npy"
+CONTENT_FILE = "content.bin"
+RECORDS_FILE = "records.jsonl"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+def is_store_path(path):
+    """True if path names a binary embedding store rather than a JSON file"""
+    path = str(path).rstrip("/\\")
+    return path.endswith(STORE_SUFFIX) or os.path.exists(os.path.join(path, META_FILE))
+
+def store_path_for(json_path):
+    """Default store location for a JSON embeddings file"""
+    root, _ = os.path.splitext(str(json_path))
+    return root + STORE_SUFFIX
+
+def save_embedding_store(embeddings_data, store_path, dtype="float32"):
+    """Write embeddings_data (list of dicts with 'embedding' and 'content') as a binary store"""
+    os.makedirs(store_path, exist_ok=True)
+
+    if embeddings_data:
+        vectors = np.asarray([item['embedding'] for item in embeddings_data], dtype=dtype)
+    else:
+        vectors = np.zeros((0, 0), dtype=dtype)
+
+    offsets = np.zeros((len(embeddings_data) + 1, 2), dtype=np.int64)
+    chunked = False
+    content_tmp = os.path.join(store_path, CONTENT_FILE + ".tmp")
+    records_tmp = os.path.join(store_path, RECORDS_FILE + ".tmp")
+    with open(content_tmp, 'wb') as content_file, open(records_tmp, 'wb') as records_file:
+        for i, item in enumerate(embeddings_data):
+            encoded = (item.get('content') or '').encode('utf-8')
+            content_file.write(encoded)
+            record = {key: value for key, value in item.items() if key not in ('embedding', 'content')}
+            chunked = chunked or 'chunk_index' in record
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            records_file.write(line)
+            offsets[i + 1] = offsets[i] + (len(encoded), len(line))
+
+    vectors_tmp = os.path.join(store_path, VECTORS_FILE + ".tmp")
+    with open(vectors_tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(vectors))
+    offsets_tmp = os.path.join(store_path, OFFSETS_FILE + ".tmp")
+    with open(offsets_tmp, 'wb') as f:
+        np.save(f, offsets)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'count': int(vectors.shape[0]),
+        'dim': int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        'dtype': str(vectors.dtype),
+        'chunked': chunked
+    }
+    meta_tmp = os.path.join(store_path, META_FILE + ".tmp")
+    with open(meta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(',', ':'))
+
+    # Swap files in last so a reader never sees a half-written store
+    os.replace(vectors_tmp, os.path.join(store_path, VECTORS_FILE))
+    os.replace(content_tmp, os.path.join(store_path, CONTENT_FILE))
+    os.replace(records_tmp, os.path.join(store_path, RECORDS_FILE))
+    os.replace(offsets_tmp, os.path.join(store_path, OFFSETS_FILE))
+    os.replace(meta_tmp, os.path.join(store_path, META_FILE))
+
+def _map_file(path):
+    """Read-only memory map of path (empty files cannot be mapped)"""
+    if os.path.getsize(path) == 0:
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class EmbeddingStore:
+    """Read-only view over a binary store; vectors, content and metadata stay memory-mapped"""
+
+    def __init__(self, store_path):
+        self.path = store_path
+        with open(os.path.join(store_path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        version = meta.get('format_version')
+        if version not in (1, FORMAT_VERSION):
+            raise ValueError(f"Unsupported embedding store version: {version}")
+
+        self.dim = meta['dim']
+        self.vectors = np.load(os.path.join(store_path, VECTORS_FILE), mmap_mode='r')
+        self._content = _map_file(os.path.join(store_path, CONTENT_FILE))
+        if version == 1:
+            # Metadata and content offsets are inline in meta.json
+            self._records = meta['records']
+            self._records_map = None
+            self.offsets = np.zeros((len(self._records) + 1, 2), dtype=np.int64)
+            for i, record in enumerate(self._records):
+                self.offsets[i] = (record['content_offset'], 0)
+                self.offsets[i + 1] = (record['content_offset'] + record['content_length'], 0)
+            self.chunked = any('chunk_index' in record for record in self._records)
+        else:
+            self._records = None
+            self._records_map = _map_file(os.path.join(store_path, RECORDS_FILE))
+            self.offsets = np.load(os.path.join(store_path, OFFSETS_FILE), mmap_mode='r')
+            self.chunked = meta['chunked']
+        self.count = len(self.offsets) - 1
+
+    def __len__(self):
+        return self.count
+
+    def content(self, i):
+        """Decode the content of document i straight from the mapped file"""
+        start, end = int(self.offsets[i][0]), int(self.offsets[i + 1][0])
+        return self._content[start:end].decode('utf-8')
+
+    def meta(self, i):
+        """Metadata of document i (file_path, source_url, ...), without content or embedding"""
+        if self._records is not None:
+            return {key: value for key, value in self._records[i].items()
+                    if key not in ('content_offset', 'content_length')}
+        start, end = int(self.offsets[i][1]), int(self.offsets[i + 1][1])
+        return json.loads(self._records_map[start:end])
+
+    def record(self, i):
+        """Metadata plus content of document i"""
+        item = self.meta(i)
+        item['content'] = self.content(i)
+        return item
+
+    def to_records(self):
+        """List of dicts in the same shape load_embeddings returns for JSON files"""
+        data = []
+        for i in range(len(self)):
+            item = self.record(i)
+            item['embedding'] = self.vectors[i]  # View into the memmap, no copy
+            data.append(item)
+        return data
+
+class StoreRecords:
+    """Sequence of a store's records (metadata plus content), decoded one at a time on access"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.store)
+        if not 0 <= i < len(self.store):
+            raise IndexError(i)
+        return self.store.record(i)
+
+    def __iter__(self):
+        return (self.store.record(i) for i in range(len(self.store)))
+
+    def file_path(self, i):
+        return self.store.meta(i).get('file_path')
+
+def load_embedding_store(store_path):
+    """Load a binary store as a list of dicts"""
+    return EmbeddingStore(store_path).to_records()
+
+def convert_json_to_store(json_path, store_path=None, dtype="float32"):
+    """Convert a JSON embeddings file to a binary store and check the result"""
+    store_path = store_path or store_path_for(json_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        embeddings_data = json.load(f)
+
+    save_embedding_store(embeddings_data, store_path, dtype=dtype)
+
+    # Verify the round trip: metadata and content must match exactly, vectors up to dtype precision
+    store = EmbeddingStore(store_path)
+    original = np.asarray([item['embedding'] for item in embeddings_data], dtype=np.float64)
+    stored = np.asarray(store.vectors, dtype=np.float64)
+    lossless = original.shape == stored.shape and np.array_equal(original, stored)
+    for i, item in enumerate(embeddings_data):
+        if store.content(i) != (item.get('content') or ''):
+            raise ValueError(f"Content mismatch for record {i} ({item.get('file_path')})")
+
+    json_mb = os.path.getsize(json_path) / (1024 * 1024)
+    store_mb = sum(os.path.getsize(os.path.join(store_path, name))
+                   for name in (VECTORS_FILE, CONTENT_FILE, RECORDS_FILE, OFFSETS_FILE, META_FILE)) / (1024 * 1024)
+    print(f"Converted {len(embeddings_data)} embeddings: {json_path} ({json_mb:.2f} MB) -> {store_path} ({store_mb:.2f} MB)")
+    if lossless:
+        print("Vectors round-trip losslessly")
+    else:
+        max_error = float(np.max(np.abs(original - stored))) if original.shape == stored.shape else float('inf')
+        print(f"Warning: vectors are not bit-exact in {dtype} (max abs error {max_error:.2e})")
+    return store_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSON embeddings file to a binary store")
+    parser.add_argument("json_path")
+    parser.add_argument("store_path", nargs="?")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    args = parser.parse_args()
+    convert_json_to_store(args.json_path, args.store_path, dtype=args.dtype)
+
+if __name__ == "__main__":
+    main()
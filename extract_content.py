@@ -1,79 +1,224 @@
 import os
 from bs4 import BeautifulSoup
 import json
+import hashlib
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+# Which HTML files were extracted, keyed by path relative to the input folder, so unchanged files are skipped
+MANIFEST_FILE = '.extract_manifest.json'
+
+def default_html_parser():
+    """lxml when it is installed (several times faster), else the built-in html.parser"""
+    parser = os.getenv('DOCUSEARCH_HTML_PARSER')
+    if parser:
+        return parser
+    try:
+        import lxml  # noqa: F401
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+HTML_PARSER = default_html_parser()
+
+def extract_text(soup):
+    """Body text of a parsed Connections page (the post inside doc-middle-content), or None"""
+    content_div = soup.find('div', class_='doc-middle-content')
+    if content_div:
+        post_div = content_div.find('div', id='post')
+        if post_div:
+            # One line per text fragment; join is linear where += re-copies the text each time
+            return '\n'.join(post_div.stripped_strings)
+    return None
+
+def write_text_file(output_file, content, original_url=None):
+    """Save extracted content in the format the embedding scripts read"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        if original_url:
+            f.write(f"Source URL: {original_url}\n\n")
+        f.write(content)
+
 def extract_content_from_html(html_file):
     try:
         with open(html_file, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f.read(), 'html.parser')
-        
-        # Find the main content div
-        content_div = soup.find('div', class_='doc-middle-content')
-        if content_div:
-            post_div = content_div.find('div', id='post')
-            if post_div:
-                # Extract text while preserving some structure
-                text = ''
-                for element in post_div.stripped_strings:
-                    text += element + '\n'
-                return text.strip()
-        return None
+            soup = BeautifulSoup(f.read(), HTML_PARSER)
+        return extract_text(soup)
     except Exception as e:
         print(f"Error processing {html_file}: {str(e)}")
         return None
 
-def process_connections_folder(input_folder, output_folder):
+def _extract_file(html_path, output_file, known_hash, known_failed=False):
+    """Extract one page; returns (status, content hash) with status 'written', 'unchanged' or 'failed'
+
+    The hash is None only when the file could not be read. known_failed says the page with
+    known_hash had no content last time, so identical bytes fail again without being parsed.
+    """
+    try:
+        with open(html_path, 'rb') as f:
+            html = f.read()
+    except OSError as e:
+        print(f"Error processing {html_path}: {str(e)}")
+        return 'failed', None
+    content_hash = hashlib.md5(html).hexdigest()
+    # Touched but identical (e.g. rewritten by a recrawl): the text file is already current
+    if content_hash == known_hash:
+        if known_failed:
+            return 'failed', content_hash
+        if os.path.exists(output_file):
+            return 'unchanged', content_hash
+
+    # Get corresponding JSON metadata file
+    json_file = Path(html_path).with_suffix('.json')
+    original_url = None
+    if json_file.exists():
+        with open(json_file, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+            original_url = metadata.get('original_url')
+
+    try:
+        content = extract_text(BeautifulSoup(html.decode('utf-8'), HTML_PARSER))
+    except Exception as e:
+        print(f"Error processing {html_path}: {str(e)}")
+        return 'failed', content_hash
+    if not content:
+        return 'failed', content_hash
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    write_text_file(output_file, content, original_url)
+    return 'written', content_hash
+
+def _extract_chunk(tasks):
+    """Worker entry point: extract a chunk of (relative path, html path, output file, known hash, known failed) tasks"""
+    results = []
+    for relative_path, html_path, output_file, known_hash, known_failed in tasks:
+        status, content_hash = _extract_file(html_path, output_file, known_hash, known_failed)
+        results.append((relative_path, html_path, status, content_hash))
+    return results
+
+def _run_chunks(chunks, workers):
+    """Results of each chunk, from a process pool unless workers is 1"""
+    if workers == 1:
+        for chunk in chunks:
+            yield _extract_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_extract_chunk, chunks)
+
+def _load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _save_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+def process_connections_folder(input_folder, output_folder, workers=None, chunk_size=32, force=False):
+    """Extract the text of every HTML page under input_folder into matching .txt files.
+
+    Pages whose mtime and size match the manifest from the previous run are skipped without
+    being read, including pages that had no content then (kept in the manifest as 'failed');
+    pages that changed on disk are hashed and skipped if their bytes are the same. Entries for
+    pages that no longer exist are dropped from the manifest.
+    The rest are parsed in a process pool (workers=1 runs in this process), chunk_size files
+    per task. force=True re-extracts everything.
+    """
     # Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
+    start_time = time.perf_counter()
+    manifest = {} if force else _load_manifest(output_folder)
     
     # Keep track of processed files
     processed_files = 0
+    unchanged_files = 0
+    skipped_failed = 0
     failed_files = []
+    tasks = []
+    stats = {}
     
     # Walk through all directories in the connections folder
     for root, _, files in os.walk(input_folder):
         for file in files:
             if file.endswith('.html'):
                 html_path = os.path.join(root, file)
+                relative_path = os.path.relpath(html_path, input_folder)
                 
                 # Create corresponding output path
-                relative_path = os.path.relpath(root, input_folder)
-                output_path = os.path.join(output_folder, relative_path)
-                os.makedirs(output_path, exist_ok=True)
-                
-                # Get corresponding JSON metadata file
-                json_file = Path(html_path).with_suffix('.json')
-                original_url = None
-                if json_file.exists():
-                    with open(json_file, 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-                        original_url = metadata.get('original_url')
-                
-                # Extract content
-                content = extract_content_from_html(html_path)
-                
-                if content:
-                    # Save content with metadata
-                    output_file = os.path.join(output_path, Path(file).stem + '.txt')
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        if original_url:
-                            f.write(f"Source URL: {original_url}\n\n")
-                        f.write(content)
+                output_file = os.path.join(output_folder, os.path.relpath(root, input_folder),
+                                           Path(file).stem + '.txt')
+                stat = os.stat(html_path)
+                stats[relative_path] = (stat.st_mtime_ns, stat.st_size)
+                entry = manifest.get(relative_path)
+                known_failed = bool(entry) and entry.get('status') == 'failed'
+                if entry and (entry['mtime_ns'], entry['size']) == stats[relative_path]:
+                    if known_failed:
+                        skipped_failed += 1
+                        continue
+                    if os.path.exists(output_file):
+                        unchanged_files += 1
+                        continue
+                tasks.append((relative_path, html_path, output_file,
+                              entry['hash'] if entry else None, known_failed))
+
+    # Pages deleted since the last run
+    removed = [relative_path for relative_path in manifest if relative_path not in stats]
+    for relative_path in removed:
+        del manifest[relative_path]
+
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks) // chunk_size, 1))
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    try:
+        for chunk_results in _run_chunks(chunks, workers):
+            for relative_path, html_path, status, content_hash in chunk_results:
+                mtime_ns, size = stats[relative_path]
+                if status == 'failed':
+                    failed_files.append(html_path)
+                    if content_hash is None:
+                        # Unreadable: retry next run
+                        manifest.pop(relative_path, None)
+                    else:
+                        manifest[relative_path] = {'mtime_ns': mtime_ns, 'size': size, 'hash': content_hash,
+                                                   'status': 'failed'}
+                    continue
+                manifest[relative_path] = {'mtime_ns': mtime_ns, 'size': size, 'hash': content_hash}
+                if status == 'written':
                     processed_files += 1
                 else:
-                    failed_files.append(html_path)
+                    unchanged_files += 1
+    finally:
+        # Keep what finished, so an interrupted run picks up where it stopped
+        _save_manifest(output_folder, manifest)
+
+    elapsed = time.perf_counter() - start_time
+    total_files = processed_files + unchanged_files + skipped_failed + len(failed_files)
     
     # Print summary
     print(f"\nProcessing complete!")
-    print(f"Successfully processed: {processed_files} files")
+    print(f"Successfully processed: {processed_files} files, unchanged: {unchanged_files}")
+    if skipped_failed:
+        print(f"Skipped {skipped_failed} unchanged files that had no content last run")
+    if removed:
+        print(f"Dropped {len(removed)} deleted files from the manifest")
+    print(f"{total_files} files in {elapsed:.2f}s ({total_files / elapsed if elapsed else 0:.1f} files/s, "
+          f"{len(tasks)} checked by {workers} worker{'s' if workers != 1 else ''})")
     if failed_files:
         print(f"Failed to process {len(failed_files)} files:")
         for file in failed_files:
             print(f"- {file}")
 
 if __name__ == "__main__":
-    input_folder = "connections"  # Your input folder with HTML files
-    output_folder = "extracted_content"  # Where to save the extracted content
+    parser = argparse.ArgumentParser(description="Extract the text of crawled Connections pages")
+    parser.add_argument("input_folder", nargs="?", default="connections", help="Your input folder with HTML files")
+    parser.add_argument("output_folder", nargs="?", default="extracted_content", help="Where to save the extracted content")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: one per CPU, 1 = no pool)")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Files per worker task")
+    parser.add_argument("--force", action="store_true", help="Re-extract files even if they are unchanged")
+    args = parser.parse_args()
     
-    process_connections_folder(input_folder, output_folder)
\ No newline at end of file
+    process_connections_folder(args.input_folder, args.output_folder, workers=args.workers,
+                               chunk_size=args.chunk_size, force=args.force)
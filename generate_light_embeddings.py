@@ -43,7 +43,8 @@ def main():
         # Process files and create light embeddings
         process_text_files(
             input_folder="extracted_content",
-            output_file="embeddings/embeddings_light.json"
+            output_file="embeddings/embeddings_light.json",
+            incremental="--incremental" in sys.argv
         )
         
         print("✅ Light embeddings generated successfully!")
@@ -0,0 +1,88 @@
+"""
+Health and readiness endpoints served by a small background thread, apart from the Streamlit script.
+
+GET /healthz  - 200 while the process is up (liveness)
+GET /readyz   - 200 once the search index and the expected embedding models are loaded, else 503
+GET /metrics  - counters and timings in the Prometheus text format
+
+Probes only read in-memory state, so they never trigger a script run, a model load or a
+network call. start_app.py starts the server and the warm-up; DOCUSEARCH_HEALTH_PORT sets the port.
+"""
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+import model_registry
+
+HEALTH_PORT = int(os.getenv('DOCUSEARCH_HEALTH_PORT', '8081'))
+
+_started_at = time.time()
+_expected_models = set()
+_indexes = {}  # index path -> version
+_server = None
+_lock = threading.Lock()
+
+def expect_model(key):
+    """Hold readiness until the model registered under key has loaded"""
+    with _lock:
+        _expected_models.add(key)
+
+def mark_index_loaded(index):
+    """Record a loaded search index (anything with .path and .version)"""
+    with _lock:
+        _indexes[str(index.path)] = index.version
+
+def status():
+    loaded = model_registry.loaded_models()
+    with _lock:
+        expected = set(_expected_models)
+        indexes = dict(_indexes)
+    models_loaded = all(key in loaded for key in expected)
+    return {
+        'ready': bool(indexes) and models_loaded,
+        'index_loaded': bool(indexes),
+        'index_version': indexes,
+        'model_loaded': models_loaded,
+        'models': {"/".join(key): seconds for key, seconds in loaded.items()},
+        'uptime_seconds': time.time() - _started_at
+    }
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/healthz':
+            self._send(200, 'application/json', json.dumps({'status': 'ok'}))
+        elif path == '/readyz':
+            state = status()
+            self._send(200 if state['ready'] else 503, 'application/json', json.dumps(state))
+        elif path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4', metrics.render_prometheus())
+        else:
+            self._send(404, 'application/json', json.dumps({'error': 'not found'}))
+
+    def _send(self, code, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Probes run every few seconds; keep them out of the app log
+        pass
+
+def start_health_server(port=HEALTH_PORT, host='0.0.0.0'):
+    """Serve the endpoints from a daemon thread; later calls return the running server"""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _HealthHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            print(f"Health endpoints on http://{host}:{port}/healthz, /readyz and /metrics")
+    return _server
@@ -0,0 +1,50 @@
+"""
+Process-wide counters and timings, exportable as JSON or in Prometheus text format.
+"""
+
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(float)
+_timings = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total seconds, max seconds]
+_lock = threading.Lock()
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+def observe(name, seconds):
+    """Record one duration under name"""
+    with _lock:
+        timing = _timings[name]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+def snapshot():
+    """Current counters and timing summaries as plain dicts"""
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {
+                'count': count,
+                'total_seconds': total,
+                'mean_seconds': total / count if count else 0.0,
+                'max_seconds': maximum
+            }
+            for name, (count, total, maximum) in _timings.items()
+        }
+    return {'counters': counters, 'timings': timings}
+
+def render_prometheus():
+    """Metrics in the Prometheus text exposition format"""
+    data = snapshot()
+    lines = []
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f"# TYPE docusearch_{name} counter")
+        lines.append(f"docusearch_{name} {value}")
+    for name, timing in sorted(data['timings'].items()):
+        lines.append(f"# TYPE docusearch_{name} summary")
+        lines.append(f"docusearch_{name}_count {timing['count']}")
+        lines.append(f"docusearch_{name}_sum {timing['total_seconds']}")
+    return "\n".join(lines) + "\n"
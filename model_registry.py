@@ -0,0 +1,64 @@
+"""
+Process-wide registry for embedding models.
+Each model is loaded once per process and shared across Streamlit sessions and reruns.
+"""
+
+import threading
+import time
+
+_models = {}
+_load_times = {}
+_key_locks = {}
+_warm_up_threads = {}  # key -> background thread loading that model
+_registry_lock = threading.Lock()
+
+def _lock_for(key):
+    with _registry_lock:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+def get_model(key, factory):
+    """Return the model registered under key, loading it with factory() on first use"""
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    # Only one thread loads a given model; others wait for it instead of loading a second copy
+    with _lock_for(key):
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            model = factory()
+            _load_times[key] = time.perf_counter() - start
+            _models[key] = model
+            print(f"Loaded embedding model {key} in {_load_times[key]:.2f}s")
+    return model
+
+def is_loaded(key):
+    return key in _models
+
+def warm_up_time(key):
+    """Seconds spent loading the model registered under key, or None if not loaded yet"""
+    return _load_times.get(key)
+
+def loaded_models():
+    """Mapping of every loaded model key to its warm-up time in seconds"""
+    return dict(_load_times)
+
+def warm_up(key, factory):
+    """Load a model in a background thread so the first query doesn't pay the load cost.
+
+    While a warm-up for key is still running, later calls (e.g. Streamlit reruns) return
+    that thread instead of starting another one.
+    """
+    if key in _models:
+        return None
+    with _registry_lock:
+        thread = _warm_up_threads.get(key)
+        if thread is not None and thread.is_alive():
+            return thread
+        thread = threading.Thread(target=get_model, args=(key, factory), daemon=True)
+        _warm_up_threads[key] = thread
+        thread.start()
+    return thread
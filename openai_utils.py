@@ -0,0 +1,203 @@
+"""
+OpenAI helpers shared by the Streamlit apps.
+
+Key validation results are cached per key hash for VALIDATION_TTL seconds, so Streamlit reruns
+don't repeat the network round trip. A cached result is dropped only when a real API call
+fails authentication (invalidate_openai_key).
+
+Clients come from a process-level registry (get_openai_client) so chat turns reuse pooled
+keep-alive connections instead of paying a TLS handshake each time. stream_chat_completion
+renders a streamed answer into a Streamlit placeholder for both apps.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import metrics
+
+VALIDATION_TTL = 6 * 3600
+# Network problems are usually transient, so don't remember them for long
+NETWORK_FAILURE_TTL = 60
+VALIDATION_MODEL = "gpt-4o-mini"
+
+# Connection pool settings for the shared clients
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+OPENAI_POOL_SIZE = int(os.getenv('OPENAI_POOL_SIZE', '10'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '120'))
+
+_clients = {}  # (key fingerprint, settings) -> OpenAI client
+_validation_cache = {}  # key fingerprint -> (expires_at, is_valid, message)
+_pending = set()
+_lock = threading.Lock()
+
+def key_fingerprint(api_key):
+    """Hash used to key caches, so raw API keys are never kept as dict keys"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def test_network_connectivity():
+    """Test basic network connectivity"""
+    try:
+        import requests
+        response = requests.get("https://api.openai.com", timeout=5)
+        return True, "Network connectivity OK"
+    except requests.exceptions.ConnectionError:
+        return False, "No internet connection"
+    except requests.exceptions.Timeout:
+        return False, "Network timeout"
+    except Exception as e:
+        return False, f"Network error: {str(e)}"
+
+def _metered_transport(limits):
+    """httpx transport that records connection setup and request times in metrics"""
+    import httpx
+
+    class MeteredTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            phase_started = {}
+            setup = []
+
+            def trace(event_name, info):
+                # httpcore reports TCP connect and TLS handshake only when a new connection is opened
+                phase, _, state = event_name.rpartition('.')
+                if phase not in ('connection.connect_tcp', 'connection.start_tls'):
+                    return
+                if state == 'started':
+                    phase_started[phase] = time.perf_counter()
+                elif state == 'complete' and phase in phase_started:
+                    setup.append(time.perf_counter() - phase_started.pop(phase))
+
+            request.extensions = {**request.extensions, 'trace': trace}
+            start = time.perf_counter()
+            try:
+                return super().handle_request(request)
+            finally:
+                # Time to response headers (streamed bodies are read afterwards)
+                metrics.observe('openai_request_seconds', time.perf_counter() - start)
+                if setup:
+                    metrics.increment('openai_connections_opened')
+                    metrics.observe('openai_connection_setup_seconds', sum(setup))
+                else:
+                    metrics.increment('openai_connections_reused')
+
+    return MeteredTransport(limits=limits)
+
+def get_openai_client(api_key, timeout=OPENAI_TIMEOUT, max_retries=OPENAI_MAX_RETRIES, pool_size=OPENAI_POOL_SIZE):
+    """Shared OpenAI client for this key and settings, created once per process"""
+    registry_key = (key_fingerprint(api_key), timeout, max_retries, pool_size)
+    with _lock:
+        client = _clients.get(registry_key)
+        if client is None:
+            import httpx
+            from openai import OpenAI
+            limits = httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+            )
+            http_client = httpx.Client(transport=_metered_transport(limits), timeout=timeout)
+            client = OpenAI(api_key=api_key, timeout=timeout, max_retries=max_retries, http_client=http_client)
+            _clients[registry_key] = client
+            metrics.increment('openai_clients_created')
+    return client
+
+def stream_chat_completion(client, messages, placeholder):
+    """Render a streamed completion into placeholder; returns the complete answer and its usage"""
+    start = time.perf_counter()
+    request = dict(model="gpt-4o-mini", messages=messages, temperature=0, max_tokens=1000, stream=True)
+    try:
+        stream = client.chat.completions.create(**request, stream_options={"include_usage": True})
+    except TypeError:
+        # openai releases before stream_options reject the argument; the usage is then estimated
+        stream = client.chat.completions.create(**request)
+    
+    parts = []
+    usage = None
+    for chunk in stream:
+        # The final chunk carries the token usage and no choices
+        if getattr(chunk, 'usage', None) is not None:
+            usage = chunk.usage
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+        if not parts:
+            metrics.observe('chat_time_to_first_token_seconds', time.perf_counter() - start)
+        parts.append(chunk.choices[0].delta.content)
+        placeholder.markdown("".join(parts) + "▌")
+    
+    metrics.observe('chat_response_seconds', time.perf_counter() - start)
+    answer = "".join(parts)
+    placeholder.markdown(answer)
+    return answer, usage
+
+def _check_openai_key(api_key):
+    """Uncached check; returns (is_valid, message, ttl)"""
+    # First test network connectivity
+    network_ok, network_msg = test_network_connectivity()
+    if not network_ok:
+        return False, network_msg, NETWORK_FAILURE_TTL
+
+    try:
+        # Same pooled connection the chat calls will use
+        client = get_openai_client(api_key).with_options(timeout=10.0)
+        # Retrieving the model checks the key and model access without a billed completion
+        client.models.retrieve(VALIDATION_MODEL)
+        return True, "API key is valid", VALIDATION_TTL
+    except Exception as e:
+        from openai import APIConnectionError
+        ttl = NETWORK_FAILURE_TTL if isinstance(e, APIConnectionError) else VALIDATION_TTL
+        return False, f"API key validation failed: {str(e)}", ttl
+
+def get_cached_validation(api_key):
+    """(is_valid, message) from the cache, or None if the key hasn't been checked recently"""
+    with _lock:
+        entry = _validation_cache.get(key_fingerprint(api_key))
+    if entry is None or entry[0] < time.time():
+        return None
+    return entry[1], entry[2]
+
+def validate_openai_key(api_key):
+    """Test if the OpenAI API key is valid and working (cached per key)"""
+    if not api_key or api_key == "your-openai-api-key-here":
+        return False, "Please enter a valid OpenAI API key"
+
+    cached = get_cached_validation(api_key)
+    if cached is not None:
+        return cached
+
+    is_valid, message, ttl = _check_openai_key(api_key)
+    with _lock:
+        _validation_cache[key_fingerprint(api_key)] = (time.time() + ttl, is_valid, message)
+    return is_valid, message
+
+def validate_openai_key_async(api_key):
+    """Cached (is_valid, message), or None while a background check is running"""
+    if not api_key or api_key == "your-openai-api-key-here":
+        return False, "Please enter a valid OpenAI API key"
+
+    cached = get_cached_validation(api_key)
+    if cached is not None:
+        return cached
+
+    fingerprint = key_fingerprint(api_key)
+    with _lock:
+        if fingerprint in _pending:
+            return None
+        _pending.add(fingerprint)
+
+    def run():
+        try:
+            validate_openai_key(api_key)
+        finally:
+            with _lock:
+                _pending.discard(fingerprint)
+
+    threading.Thread(target=run, daemon=True).start()
+    return None
+
+def invalidate_openai_key(api_key):
+    """Forget the cached result, e.g. after a chat call fails with an authentication error"""
+    if api_key:
+        with _lock:
+            _validation_cache.pop(key_fingerprint(api_key), None)
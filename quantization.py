@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Compressed embedding codes for the search index.
+
+int8 - per-dimension symmetric scalar quantization, 1 byte per dimension (4x smaller than float32)
+pq   - product quantization, 1 byte per sub-vector (e.g. 16 bytes for a 384-d vector)
+
+Scores from codes are approximate; SearchIndex can re-score the best candidates exactly
+against the float vectors, which stay memory-mapped on disk.
+
+Usage: python quantization.py embeddings/embeddings_light.store [--methods int8 pq] [--pq-m 16]
+fits and saves the codes, then reports recall@k against the float baseline.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+BLOCK_ROWS = 16384
+
+class ScalarQuantizer:
+    method = 'int8'
+
+    def __init__(self, scale):
+        # Dimension i is stored as round(x / scale[i]) in [-127, 127]
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, matrix):
+        max_abs = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = np.abs(np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32))
+            max_abs = np.maximum(max_abs, block.max(axis=0))
+        max_abs[max_abs == 0] = 1.0
+        return cls(max_abs / 127.0)
+
+    def encode(self, matrix):
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            codes[start:start + len(block)] = np.clip(np.rint(block / self.scale), -127, 127)
+        return codes
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale
+
+    def scores(self, codes, query):
+        """Approximate inner products of every code with query"""
+        scaled_query = query * self.scale
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ scaled_query
+        return scores
+
+    def save(self, path):
+        np.savez(path, method=self.method, scale=self.scale)
+
+def _kmeans_l2(vectors, n_clusters, n_iter, rng):
+    """Plain (Euclidean) k-means; returns the centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    vector_sq = (vectors ** 2).sum(axis=1, keepdims=True)
+    for _ in range(n_iter):
+        distances = vector_sq - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1)
+        assignment = np.argmin(distances, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                centroids[cluster] = vectors[rng.integers(len(vectors))]
+    return centroids
+
+class ProductQuantizer:
+    method = 'pq'
+
+    def __init__(self, codebooks):
+        # codebooks[j] holds the 256 (or fewer) centroids for sub-vector j
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def m(self):
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def fit(cls, matrix, m=16, n_iter=15, sample_size=20000, seed=0):
+        dim = matrix.shape[1]
+        if dim % m:
+            raise ValueError(f"PQ sub-vector count {m} must divide the embedding dimension {dim}")
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(matrix), min(sample_size, len(matrix)), replace=False)
+        vectors = np.asarray(matrix[np.sort(sample)], dtype=np.float32)
+        ksub = min(256, len(vectors))
+        sub_dim = dim // m
+        codebooks = [
+            _kmeans_l2(vectors[:, j * sub_dim:(j + 1) * sub_dim], ksub, n_iter, rng)
+            for j in range(m)
+        ]
+        return cls(codebooks)
+
+    def _split(self, matrix):
+        return np.asarray(matrix, dtype=np.float32).reshape(len(matrix), self.m, -1)
+
+    def encode(self, matrix):
+        codes = np.empty((len(matrix), self.m), dtype=np.uint8)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            block = self._split(matrix[start:start + BLOCK_ROWS])
+            for j in range(self.m):
+                centroids = self.codebooks[j]
+                distances = -2 * block[:, j] @ centroids.T + (centroids ** 2).sum(axis=1)
+                codes[start:start + len(block), j] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def scores(self, codes, query):
+        """Approximate inner products via a per-query lookup table"""
+        table = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(self.m, -1))
+        columns = np.arange(self.m)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = table[columns, block].sum(axis=1)
+        return scores
+
+    def save(self, path):
+        np.savez(path, method=self.method, codebooks=self.codebooks)
+
+QUANTIZERS = {'int8': ScalarQuantizer, 'pq': ProductQuantizer}
+
+def load_quantizer(path):
+    with np.load(path) as data:
+        method = str(data['method'])
+        if method == 'int8':
+            return ScalarQuantizer(data['scale'])
+        if method == 'pq':
+            return ProductQuantizer(data['codebooks'])
+    raise ValueError(f"Unknown quantization method in {path}: {method}")
+
+def quantized_paths(embeddings_path, method):
+    """(codes path, quantizer path) for an embeddings file or store"""
+    embeddings_path = str(embeddings_path).rstrip("/\\")
+    if os.path.isdir(embeddings_path):
+        base = os.path.join(embeddings_path, method)
+    else:
+        base = os.path.splitext(embeddings_path)[0] + "." + method
+    return base + ".codes.npy", base + ".quantizer.npz"
+
+def build_quantized(matrix, method, embeddings_path=None, **fit_kwargs):
+    """Fit a quantizer, encode matrix and optionally save both next to the embeddings"""
+    quantizer = QUANTIZERS[method].fit(matrix, **fit_kwargs)
+    codes = quantizer.encode(matrix)
+    if embeddings_path:
+        codes_path, quantizer_path = quantized_paths(embeddings_path, method)
+        np.save(codes_path, codes)
+        quantizer.save(quantizer_path)
+    return quantizer, codes
+
+def load_quantized(embeddings_path, method):
+    """(quantizer, memory-mapped codes) saved for the embeddings, or None if missing"""
+    codes_path, quantizer_path = quantized_paths(embeddings_path, method)
+    if not (os.path.exists(codes_path) and os.path.exists(quantizer_path)):
+        return None
+    return load_quantizer(quantizer_path), np.load(codes_path, mmap_mode='r')
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize stored embeddings and report recall@k")
+    parser.add_argument("embeddings_path")
+    parser.add_argument("--methods", nargs="+", default=["int8", "pq"], choices=sorted(QUANTIZERS))
+    parser.add_argument("--pq-m", type=int, default=16, help="PQ sub-vectors per embedding")
+    parser.add_argument("--rescore", type=int, nargs="+", default=[0, 50])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    from search_index import load_search_index, top_k_indices
+
+    def load_json(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    index = load_search_index(args.embeddings_path, load_json, index_type='flat', hybrid='off')
+    matrix = index.matrix
+    print(f"{len(matrix)} vectors x {matrix.shape[1]} dims, float32 = {matrix.shape[1] * 4} bytes/vector")
+
+    # Perturbed stored vectors stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(matrix), min(args.queries, len(matrix)), replace=False)
+    queries = np.asarray(matrix[sample], dtype=np.float32)
+    queries = queries + rng.normal(scale=0.02, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    exact = [set(top_k_indices(matrix @ query, args.top_k)) for query in queries]
+
+    for method in args.methods:
+        start = time.perf_counter()
+        fit_kwargs = {'m': args.pq_m} if method == 'pq' else {}
+        quantizer, codes = build_quantized(matrix, method, args.embeddings_path, **fit_kwargs)
+        print(f"\n{method}: {codes.nbytes // len(codes)} bytes/vector, built in {time.perf_counter() - start:.2f}s, "
+              f"saved to {quantized_paths(args.embeddings_path, method)[0]}")
+
+        for rescore in args.rescore:
+            found = []
+            start = time.perf_counter()
+            for query in queries:
+                approx = quantizer.scores(codes, query)
+                candidates = top_k_indices(approx, max(args.top_k, rescore))
+                if rescore:
+                    candidates = candidates[top_k_indices(matrix[candidates] @ query, args.top_k)]
+                found.append(set(candidates[:args.top_k]))
+            ms = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+            label = f"rescore top {rescore}" if rescore else "codes only"
+            print(f"  {label:<16} recall@{args.top_k} = {recall:.3f}, {ms:.3f} ms/query")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Bounded LRU cache of query embeddings, shared by Search, Chat and the CLI.
+
+Keys are the whitespace- and case-normalized query plus the model id, so "Pay  Plan" and
+"pay plan" reuse one transformer forward pass. An optional SQLite tier keeps embeddings
+across restarts (set DOCUSEARCH_QUERY_CACHE to a file path); it is pruned to the TTL and
+DOCUSEARCH_QUERY_CACHE_DISK_SIZE rows, oldest first.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Expired and excess disk rows are deleted once per this many puts (and when the cache opens)
+PRUNE_EVERY = 100
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size=1024, ttl=7 * 24 * 3600, disk_path=None, disk_max_size=10000):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disk_max_size = disk_max_size
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (created, embedding)
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute('''
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    created REAL,
+                    embedding BLOB
+                )
+            ''')
+            self._disk.execute('CREATE INDEX IF NOT EXISTS query_embeddings_created ON query_embeddings (created)')
+            self._prune_disk()
+            self._disk.commit()
+
+    @staticmethod
+    def make_key(model_id, query):
+        return f"{model_id}\n{normalize_query(query)}"
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, model_id, query):
+        """Cached embedding for the query, or None"""
+        key = self.make_key(model_id, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    'SELECT created, embedding FROM query_embeddings WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[0]):
+                    embedding = np.frombuffer(row[1], dtype=np.float32)
+                    self._remember(key, row[0], embedding)
+                    self.disk_hits += 1
+                    return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, model_id, query, embedding):
+        key = self.make_key(model_id, query)
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.flags.writeable = False  # Shared between callers
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, embedding)
+            if self._disk is not None:
+                self._disk.execute(
+                    'INSERT OR REPLACE INTO query_embeddings (key, created, embedding) VALUES (?, ?, ?)',
+                    (key, created, embedding.tobytes())
+                )
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= PRUNE_EVERY:
+                    self._prune_disk()
+                self._disk.commit()
+        return embedding
+
+    def _prune_disk(self):
+        """Delete expired rows and the oldest rows beyond disk_max_size (the caller commits)"""
+        self._puts_since_prune = 0
+        if self.ttl is not None:
+            self._disk.execute('DELETE FROM query_embeddings WHERE created < ?', (time.time() - self.ttl,))
+        if self.disk_max_size is not None:
+            self._disk.execute('''
+                DELETE FROM query_embeddings WHERE key IN (
+                    SELECT key FROM query_embeddings ORDER BY created DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.disk_max_size,))
+
+    def _remember(self, key, created, embedding):
+        self._entries[key] = (created, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, model_id, query, compute):
+        """Cached embedding, or compute() it and cache the result"""
+        embedding = self.get(model_id, query)
+        if embedding is None:
+            embedding = self.put(model_id, query, compute())
+        return embedding
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def get_query_cache():
+    """Process-wide cache configured from DOCUSEARCH_QUERY_CACHE* environment variables"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = QueryEmbeddingCache(
+                    max_size=int(os.getenv('DOCUSEARCH_QUERY_CACHE_SIZE', '1024')),
+                    ttl=float(os.getenv('DOCUSEARCH_QUERY_CACHE_TTL', str(7 * 24 * 3600))),
+                    disk_path=os.getenv('DOCUSEARCH_QUERY_CACHE') or None,
+                    disk_max_size=int(os.getenv('DOCUSEARCH_QUERY_CACHE_DISK_SIZE', '10000'))
+                )
+    return _shared_cache
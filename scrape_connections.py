@@ -13,8 +13,13 @@ import sqlite3
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 import time
+import random
+import argparse
+from requests.adapters import HTTPAdapter
+from extract_content import HTML_PARSER, extract_text, write_text_file
 
-# only takes 40 minutes to scrape
+# Politeness is a global per-host request rate (token bucket) rather than a sleep in every worker,
+# so more workers overlap network waits without raising the request rate
 
 # Disable SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -22,10 +27,87 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # Add a thread-local storage for database connections
 thread_local = threading.local()
 
+# Responses worth retrying after a backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class HostRateLimiter:
+    """One token bucket per host, shared by every worker"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        if not self.rate:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+def get_session(pool_size):
+    """Thread-local Session, so each worker reuses its keep-alive connections"""
+    if not hasattr(thread_local, "session"):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.verify = False
+        thread_local.session = session
+    return thread_local.session
+
+def fetch(url, rate_limiter, max_retries=3, backoff=1.0, timeout=30, pool_size=10, headers=None):
+    """GET url through the pooled session, retrying connection errors and 429/5xx with exponential backoff"""
+    session = get_session(pool_size)
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(url)
+        try:
+            response = session.get(url, timeout=timeout, headers=headers)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        # Jitter keeps workers from retrying in lockstep
+        time.sleep(delay * (0.5 + random.random() / 2))
+
 def setup_database(output_folder):
     db_path = os.path.join(output_folder, 'scrape_data.db')
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
     c = conn.cursor()
+    # WAL lets the workers' page writes and the batched frontier writes proceed without blocking readers
+    c.execute('PRAGMA journal_mode=WAL')
     
     # Create tables if they don't exist
     c.execute('''
@@ -37,6 +119,19 @@ def setup_database(output_folder):
             UNIQUE(content_hash)
         )
     ''')
+    # Validators for conditional requests, added to databases created before they were stored
+    columns = {row[1] for row in c.execute('PRAGMA table_info(pages)')}
+    for column in ('etag', 'last_modified'):
+        if column not in columns:
+            c.execute(f'ALTER TABLE pages ADD COLUMN {column} TEXT')
+    # Outgoing links of each page, so an unchanged (304) page still feeds the frontier
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS page_links (
+            url TEXT,
+            target TEXT,
+            PRIMARY KEY (url, target)
+        )
+    ''')
     conn.commit()
     return conn
 
@@ -45,33 +140,157 @@ def get_db_connection(output_folder):
         thread_local.connection = setup_database(output_folder)
     return thread_local.connection
 
-def scrape_connections(base_url, output_folder, max_workers=5):
+def remember_validators(cursor, url, response):
+    """Store the response's ETag/Last-Modified (if any) and the scrape time for an already known page"""
+    cursor.execute('''
+        UPDATE pages SET last_scraped = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+        WHERE url = ?
+    ''', (str(datetime.now()), response.headers.get('ETag'), response.headers.get('Last-Modified'), url))
+
+class CrawlState:
+    """Frontier and scrape record in the crawl database, written in batched transactions.
+
+    Workers update the in-memory copy; queued links, finished pages and scrape records are
+    buffered and flushed together every flush_every pages (or flush_interval seconds), so the
+    I/O per page stays constant however large the crawl gets. The frontier table holds every URL
+    of the current crawl, flagged done once its page has finished, so an interrupted crawl resumes
+    with the pages in flight and skips only what this crawl already fetched.
+    """
+
+    def __init__(self, output_folder, flush_every=50, flush_interval=5.0):
+        self.conn = sqlite3.connect(os.path.join(output_folder, 'scrape_data.db'), timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS frontier (url TEXT PRIMARY KEY, done INTEGER NOT NULL DEFAULT 0)')
+        # Frontier tables from before the done flag held only pending URLs
+        if 'done' not in {row[1] for row in self.conn.execute('PRAGMA table_info(frontier)')}:
+            self.conn.execute('ALTER TABLE frontier ADD COLUMN done INTEGER NOT NULL DEFAULT 0')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS scrape_record (
+                url TEXT PRIMARY KEY,
+                scraped_at TEXT,
+                last_updated TEXT
+            )
+        ''')
+        self.conn.commit()
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._queued = []
+        self._finished = []
+        self._records = {}
+        self._last_flush = time.time()
+
+    def import_json(self, scrape_record_file, to_visit_file):
+        """Move the scrape_record.json / to_visit.json of older crawls into the database, once"""
+        imported = False
+        if os.path.exists(scrape_record_file):
+            with open(scrape_record_file, 'r') as f:
+                records = json.load(f)
+            self.conn.executemany('INSERT OR REPLACE INTO scrape_record (url, scraped_at, last_updated) VALUES (?, ?, ?)',
+                                  [(url, record.get('scraped_at'), record.get('last_updated'))
+                                   for url, record in records.items()])
+            imported = True
+        if os.path.exists(to_visit_file):
+            with open(to_visit_file, 'r') as f:
+                self.conn.executemany('INSERT OR IGNORE INTO frontier (url) VALUES (?)',
+                                      [(url,) for url in json.load(f)])
+            imported = True
+        self.conn.commit()
+        for path in (scrape_record_file, to_visit_file):
+            if os.path.exists(path):
+                os.replace(path, path + '.imported')
+        if imported:
+            print("Imported scrape_record.json / to_visit.json into the crawl database")
+
+    def load_frontier(self):
+        """(URLs still to visit, URLs this crawl has finished)"""
+        to_visit, finished = set(), set()
+        for url, done in self.conn.execute('SELECT url, done FROM frontier'):
+            (finished if done else to_visit).add(url)
+        return to_visit, finished
+
+    def load_scrape_record(self):
+        return {url: {'scraped_at': scraped_at, 'last_updated': last_updated}
+                for url, scraped_at, last_updated in self.conn.execute(
+                    'SELECT url, scraped_at, last_updated FROM scrape_record')}
+
+    def queue(self, urls):
+        with self._lock:
+            self._queued.extend(urls)
+
+    def record(self, url, entry):
+        with self._lock:
+            self._records[url] = entry
+
+    def finish(self, url):
+        """Mark a page done, flushing the buffered changes when a batch is full"""
+        with self._lock:
+            self._finished.append(url)
+            due = (len(self._finished) >= self.flush_every
+                   or time.time() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            queued, self._queued = self._queued, []
+            finished, self._finished = self._finished, []
+            records, self._records = self._records, {}
+            self._last_flush = time.time()
+            # One transaction per batch; finished pages are written after the links queued with them
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO frontier (url) VALUES (?)', [(url,) for url in queued])
+                self.conn.executemany('INSERT OR REPLACE INTO frontier (url, done) VALUES (?, 1)',
+                                      [(url,) for url in finished])
+                self.conn.executemany('INSERT OR REPLACE INTO scrape_record (url, scraped_at, last_updated) VALUES (?, ?, ?)',
+                                      [(url, entry['scraped_at'], entry['last_updated']) for url, entry in records.items()])
+
+    def complete(self):
+        """Flush and empty the frontier: the crawl finished, so the next run starts a new one"""
+        self.flush()
+        self.reset()
+
+    def reset(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM frontier')
+
+    def close(self):
+        self.conn.close()
+
+def scrape_connections(base_url, output_folder, max_workers=5, requests_per_second=5.0, burst=5,
+                       max_retries=3, backoff=1.0, timeout=30, text_folder=None):
     os.makedirs(output_folder, exist_ok=True)
     visited_urls = set()
     to_visit = set()
     url_lock = threading.Lock()  # Lock for thread-safe URL set operations
+    # Signalled when links are added or a page finishes, so idle workers wake up
+    frontier_changed = threading.Condition(url_lock)
+    in_flight = 0
+    rate_limiter = HostRateLimiter(requests_per_second, burst)
+    start_time = time.time()
+    pages_fetched = 0
+    pages_not_modified = 0
+    pages_failed = 0
     
     # Setup initial database connection
     conn = setup_database(output_folder)
     
-    # Load previously scraped URLs and to_visit queue
-    scrape_record_file = os.path.join(output_folder, 'scrape_record.json')
-    to_visit_file = os.path.join(output_folder, 'to_visit.json')
-    
-    if os.path.exists(scrape_record_file):
-        with open(scrape_record_file, 'r') as f:
-            scrape_record = json.load(f)
-        visited_urls = set(scrape_record.keys())
+    # Load previously scraped URLs and the to_visit queue from the crawl database
+    state = CrawlState(output_folder)
+    state.import_json(os.path.join(output_folder, 'scrape_record.json'),
+                      os.path.join(output_folder, 'to_visit.json'))
+    scrape_record = state.load_scrape_record()
+    to_visit, finished_urls = state.load_frontier()
+
+    if to_visit:
+        # Resuming an interrupted crawl: pages this crawl already fetched are not fetched again
+        visited_urls = finished_urls
+        print(f"Resuming crawl with {len(to_visit)} queued pages, {len(visited_urls)} done")
     else:
-        scrape_record = {}
-
-    if os.path.exists(to_visit_file):
-        with open(to_visit_file, 'r') as f:
-            to_visit = set(json.load(f))
-    
-    # If to_visit is empty, start with the base_url
-    if not to_visit:
+        # New crawl from the base_url; known pages are revisited with conditional requests
+        state.reset()
         to_visit.add(base_url)
+        state.queue([base_url])
 
     def is_valid_url(url):
         parsed = urlparse(url)
@@ -140,14 +359,57 @@ def scrape_connections(base_url, output_folder, max_workers=5):
                 return datetime.strptime(date_match.group(1), '%B %d, %Y').date()
         return None
 
+    def find_links(soup, url):
+        return {normalize_url(urljoin(url, link['href'])) for link in soup.find_all(['a', 'area'], href=True)}
+
+    def follow_links(cursor, url, page_urls):
+        """Store the page's outgoing links (for later 304s) and queue the ones not seen yet"""
+        cursor.execute('DELETE FROM page_links WHERE url = ?', (url,))
+        cursor.executemany('INSERT OR IGNORE INTO page_links (url, target) VALUES (?, ?)',
+                           [(url, next_url) for next_url in page_urls])
+        # Thread-safe update of to_visit set
+        with url_lock:
+            new_urls = {next_url for next_url in page_urls if is_valid_url(next_url)}
+            to_visit.update(new_urls)
+            print(f"Found {len(to_visit)} links to visit")
+        state.queue(new_urls)
+
     def scrape_page(url):
-        time.sleep(1)  # Add a 1-second delay between requests
+        """Fetch and save one page; returns False if it should be retried (connection errors, 429/5xx)"""
+        nonlocal pages_fetched, pages_not_modified
         url = normalize_url(url)
         conn = get_db_connection(output_folder)
         cursor = conn.cursor()
         
         try:
-            response = requests.get(url, verify=False)
+            # Ask the server to skip the body if the page hasn't changed since the last crawl
+            headers = {}
+            cursor.execute('SELECT etag, last_modified FROM pages WHERE url = ?', (url,))
+            validators = cursor.fetchone()
+            if validators:
+                if validators[0]:
+                    headers['If-None-Match'] = validators[0]
+                if validators[1]:
+                    headers['If-Modified-Since'] = validators[1]
+
+            response = fetch(url, rate_limiter, max_retries=max_retries, backoff=backoff,
+                             timeout=timeout, pool_size=max_workers, headers=headers)
+            with url_lock:
+                pages_fetched += 1
+
+            if response.status_code == 304:
+                # Unchanged: no parsing or file writes, just queue the links seen last time
+                cursor.execute('SELECT target FROM page_links WHERE url = ?', (url,))
+                known_urls = [row[0] for row in cursor.fetchall()]
+                remember_validators(cursor, url, response)
+                conn.commit()
+                with url_lock:
+                    pages_not_modified += 1
+                    new_urls = {next_url for next_url in known_urls if is_valid_url(next_url)}
+                    to_visit.update(new_urls)
+                state.queue(new_urls)
+                return
+
             response.raise_for_status()
 
             content_type = response.headers.get('content-type', '').split(';')[0]
@@ -164,6 +426,12 @@ def scrape_connections(base_url, output_folder, max_workers=5):
             existing_url = cursor.fetchone()
             
             if existing_url:
+                if existing_url[0] == url:
+                    # Same page, unchanged; keep its validators current for the next crawl and
+                    # still follow its links, or a recrawl without validators stops here
+                    follow_links(cursor, url, find_links(BeautifulSoup(response.text, HTML_PARSER), url))
+                    remember_validators(cursor, url, response)
+                    conn.commit()
                 print(f"Skipping {url}: Content already exists at {existing_url[0]}")
                 return
 
@@ -183,14 +451,17 @@ def scrape_connections(base_url, output_folder, max_workers=5):
             with open(file_path, 'wb') as f:
                 f.write(response.content)
 
-            # Extract update date
-            soup = BeautifulSoup(response.text, 'html.parser')
+            # Parse once for the update date, the links and the body text
+            soup = BeautifulSoup(response.text, HTML_PARSER)
             update_date = extract_update_date(soup)
 
             # Check if we need to update based on the extracted date
             if url in scrape_record and update_date:
                 last_updated = datetime.fromisoformat(scrape_record[url]['last_updated']) if scrape_record[url]['last_updated'] else None
                 if last_updated and update_date <= last_updated.date():
+                    follow_links(cursor, url, find_links(soup, url))
+                    remember_validators(cursor, url, response)
+                    conn.commit()
                     print(f"Skipping {url}: No new updates")
                     return
 
@@ -204,71 +475,99 @@ def scrape_connections(base_url, output_folder, max_workers=5):
             with open(json_file_path, 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, ensure_ascii=False, indent=2)
 
-            # Parse HTML content for links
-            soup = BeautifulSoup(response.text, 'html.parser')
-            new_urls = set()
-            for link in soup.find_all(['a', 'area'], href=True):
-                next_url = normalize_url(urljoin(url, link['href']))
-                if is_valid_url(next_url):
-                    new_urls.add(next_url)
+            # Write the extracted text directly, so a separate extract_content.py pass isn't needed
+            if text_folder:
+                content = extract_text(soup)
+                if content:
+                    text_path = os.path.join(text_folder, os.path.relpath(folder_path, output_folder))
+                    os.makedirs(text_path, exist_ok=True)
+                    write_text_file(os.path.join(text_path, safe_name + '.txt'), content, url)
 
-            # Thread-safe update of to_visit set
-            with url_lock:
-                to_visit.update(new_urls)
-                print(f"Found {len(to_visit)} links to visit")
+            follow_links(cursor, url, find_links(soup, url))
 
-            # Save to database
+            # Save to database, with the validators for the next conditional request
             cursor.execute('''
-                INSERT OR REPLACE INTO pages (url, content_hash, last_scraped, last_updated)
-                VALUES (?, ?, ?, ?)
-            ''', (url, content_hash, str(datetime.now()), str(update_date) if update_date else None))
+                INSERT OR REPLACE INTO pages (url, content_hash, last_scraped, last_updated, etag, last_modified)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (url, content_hash, str(datetime.now()), str(update_date) if update_date else None,
+                  response.headers.get('ETag'), response.headers.get('Last-Modified')))
             conn.commit()
 
-            # Thread-safe update of scrape record
+            # Thread-safe update of scrape record; written to the database with the next batch
+            entry = {
+                'scraped_at': str(datetime.now()),
+                'last_updated': str(update_date) if update_date else None
+            }
             with url_lock:
-                scrape_record[url] = {
-                    'scraped_at': str(datetime.now()),
-                    'last_updated': str(update_date) if update_date else None
-                }
-                # Save updated scrape record
-                with open(scrape_record_file, 'w') as f:
-                    json.dump(scrape_record, f, indent=2)
+                scrape_record[url] = entry
+            state.record(url, entry)
 
+        except requests.HTTPError as e:
+            print(f"Error scraping {url}: {e}")
+            # Other client errors will not change on a retry
+            return e.response is not None and 400 <= e.response.status_code < 500 and e.response.status_code != 429
         except requests.RequestException as e:
             print(f"Error scraping {url}: {e}")
-
-        # Thread-safe save of to_visit queue
-        with url_lock:
-            with open(to_visit_file, 'w') as f:
-                json.dump(list(to_visit), f, indent=2)
+            return False
 
     def process_urls():
+        nonlocal in_flight, pages_failed
         while True:
-            # Thread-safe URL retrieval
-            with url_lock:
+            # Thread-safe URL retrieval; wait while other workers may still add links
+            with frontier_changed:
+                while not to_visit and in_flight:
+                    frontier_changed.wait()
                 if not to_visit:
                     break
                 url = to_visit.pop()
-                if url in visited_urls:
-                    continue
-                visited_urls.add(url)
+                already_visited = url in visited_urls
+                if not already_visited:
+                    visited_urls.add(url)
+                    in_flight += 1
+            if already_visited:
+                # finish() may flush to the database, so it runs outside the frontier lock
+                state.finish(url)
+                continue
 
-            scrape_page(url)
+            try:
+                # A page that failed to fetch (or raised) stays pending, so a resumed crawl retries it
+                if scrape_page(url) is False:
+                    with url_lock:
+                        pages_failed += 1
+                else:
+                    state.finish(url)
+            finally:
+                with frontier_changed:
+                    in_flight -= 1
+                    frontier_changed.notify_all()
 
     # Use ThreadPoolExecutor for concurrent scraping
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # Start with multiple workers
         futures = [executor.submit(process_urls) for _ in range(max_workers)]
         # Wait for all tasks to complete
+        crawl_failed = False
         for future in as_completed(futures):
             try:
                 future.result()
             except Exception as e:
+                crawl_failed = True
                 print(f"An error occurred: {e}")
 
-    # Clear the to_visit file when scraping is complete
-    if os.path.exists(to_visit_file):
-        os.remove(to_visit_file)
+    elapsed = time.time() - start_time
+    print(f"Fetched {pages_fetched} pages in {elapsed:.1f}s ({pages_fetched / elapsed if elapsed else 0:.2f} pages/s), "
+          f"{pages_not_modified} not modified")
+
+    # Clear the frontier when scraping is complete; after an error keep it so the next run resumes
+    if crawl_failed:
+        state.flush()
+        print("Crawl did not finish cleanly; run again to resume it")
+    elif pages_failed:
+        state.flush()
+        print(f"{pages_failed} pages could not be fetched; run again to retry them")
+    else:
+        state.complete()
+    state.close()
 
     # Close all database connections
     for thread in threading.enumerate():
@@ -276,6 +575,17 @@ def scrape_connections(base_url, output_folder, max_workers=5):
             thread_local.connection.close()
 
 if __name__ == "__main__":
-    base_url = "http://connections/"
-    output_folder = "connections"
-    scrape_connections(base_url, output_folder, max_workers=5)
+    parser = argparse.ArgumentParser(description="Crawl the Connections site")
+    parser.add_argument("--base-url", default="http://connections/")
+    parser.add_argument("--output-folder", default="connections")
+    parser.add_argument("--workers", type=int, default=5, help="Concurrent requests in flight")
+    parser.add_argument("--rate", type=float, default=5.0, help="Requests per second per host (0 = unlimited)")
+    parser.add_argument("--burst", type=int, default=5, help="Requests allowed back to back per host")
+    parser.add_argument("--retries", type=int, default=3, help="Retries for connection errors and 429/5xx")
+    parser.add_argument("--backoff", type=float, default=1.0, help="First retry delay in seconds, doubled each time")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--text-folder", help="Also write each page's extracted text here (as extract_content.py does)")
+    args = parser.parse_args()
+    scrape_connections(args.base_url, args.output_folder, max_workers=args.workers,
+                       requests_per_second=args.rate, burst=args.burst, max_retries=args.retries,
+                       backoff=args.backoff, timeout=args.timeout, text_folder=args.text_folder)
@@ -1,15 +1,6 @@
-import json
-import numpy as np
 import os
-from create_embeddings import EmbeddingProcessor, search_embeddings
-
-def load_embeddings(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    # Convert lists to numpy arrays for similarity calculations
-    for item in data:
-        item['embedding'] = np.array(item['embedding'])
-    return data
+from create_embeddings import search_embeddings, load_embeddings
+from search_index import load_search_index
 
 def main():
     embeddings_file = "embeddings/embeddings.json"
@@ -21,7 +12,7 @@ def main():
     
     # Load embeddings
     print("Loading embeddings...")
-    embeddings_data = load_embeddings(embeddings_file)
+    embeddings_data = load_search_index(embeddings_file, load_embeddings)
     print(f"Loaded {len(embeddings_data)} embeddings")
     
     # Interactive search loop
@@ -0,0 +1,353 @@
+"""
+In-memory search index over loaded embeddings.
+Built once per embeddings file and shared by every query instead of re-stacking the vectors each time.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+from embedding_store import is_store_path, EmbeddingStore, StoreRecords, META_FILE
+from ann_index import IVFIndex, ann_path_for
+from quantization import build_quantized, load_quantized, quantized_paths
+from bm25_index import BM25Index, bm25_path_for, build_bm25_index
+
+# "flat" scans every vector, "ivf" uses the approximate index, "auto" picks ivf for large indexes
+INDEX_TYPE = os.getenv('DOCUSEARCH_INDEX_TYPE', 'auto')
+IVF_NPROBE = int(os.getenv('DOCUSEARCH_IVF_NPROBE', '8'))
+AUTO_IVF_MIN_ROWS = 20000
+# "none", "int8" or "pq"; quantized codes do the first scoring pass
+QUANTIZATION = os.getenv('DOCUSEARCH_QUANTIZATION', 'none')
+# Candidates re-scored exactly against the float vectors (0 = trust the codes)
+RESCORE_CANDIDATES = int(os.getenv('DOCUSEARCH_RESCORE', '50'))
+# Fusion of BM25 with dense scores: "rrf" (reciprocal rank fusion), "weighted" or "off"
+HYBRID = os.getenv('DOCUSEARCH_HYBRID', 'rrf')
+# Share of the lexical score in "weighted" fusion
+HYBRID_WEIGHT = float(os.getenv('DOCUSEARCH_HYBRID_WEIGHT', '0.3'))
+RRF_K = 60
+# Chunked search doubles its passage over-fetch until top_k documents are covered, up to this many rows
+MAX_OVERFETCH = 4096
+
+def top_k_indices(scores, top_k):
+    """Indices of the top_k highest scores, best first, without sorting every score"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.array([], dtype=int)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def normalize_rows(vectors):
+    """Return vectors as float32 with unit-length rows, reusing the input when it already is"""
+    if len(vectors) == 0:
+        return np.zeros((0, vectors.shape[1] if np.ndim(vectors) == 2 else 0), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    # Embeddings saved with normalize_embeddings=True can be used as-is (keeps a memmap zero-copy)
+    if vectors.dtype == np.float32 and np.allclose(norms, 1.0, atol=1e-4):
+        return vectors
+    norms[norms == 0] = 1.0
+    return (np.asarray(vectors, dtype=np.float32) / norms).astype(np.float32)
+
+class SearchIndex:
+    """Pre-normalized embedding matrix plus the row id -> document metadata mapping"""
+
+    def __init__(self, vectors, records, chunked=None):
+        if len(vectors) != len(records):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(records)} documents")
+        self.matrix = normalize_rows(vectors)
+        # Row i of the matrix belongs to records[i]; a list, or StoreRecords reading a store on access
+        self.records = records
+        # Chunked indexes hold several passages per document
+        self.chunked = chunked if chunked is not None else any('chunk_index' in record for record in records)
+        # Set by load_search_index: the embeddings file and a fingerprint of its contents
+        self.path = None
+        self.version = None
+        # Optional approximate nearest-neighbour index over self.matrix
+        self.ann = None
+        # Optional compressed codes for the first scoring pass
+        self.quantizer = None
+        self.codes = None
+        self.rescore = RESCORE_CANDIDATES
+        # Optional BM25 index over the same rows, fused with the dense ranking
+        self.lexical = None
+        self.hybrid = HYBRID
+
+    @classmethod
+    def from_embeddings(cls, embeddings_data):
+        """Build an index from load_embeddings output (list of dicts with an 'embedding' key)"""
+        if embeddings_data:
+            vectors = np.asarray([item['embedding'] for item in embeddings_data], dtype=np.float32)
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        records = [{key: value for key, value in item.items() if key != 'embedding'}
+                   for item in embeddings_data]
+        return cls(vectors, records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, idx):
+        return self.records[idx]
+
+    def documents(self):
+        """One record per document (the first passage of each chunked document)"""
+        if not self.chunked:
+            return self.records
+        seen = set()
+        documents = []
+        for record in self.records:
+            if record['file_path'] not in seen:
+                seen.add(record['file_path'])
+                documents.append(record)
+        return documents
+
+    def build_ann(self, nlist=None, nprobe=IVF_NPROBE):
+        """Build an IVF index over the matrix; searches then only score the probed lists"""
+        self.ann = IVFIndex.build(self.matrix, nlist=nlist, nprobe=nprobe)
+        return self.ann
+
+    @staticmethod
+    def _normalize_query(query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm > 0:
+            query = query / query_norm
+        return query
+
+    def scores(self, query_embedding):
+        """Cosine similarity of the query against every document"""
+        return self.matrix @ self._normalize_query(query_embedding)
+
+    def _rank(self, query, count, nprobe=None, exact=False):
+        """(row ids, scores) of the best `count` rows, best first"""
+        # Restrict to the probed IVF lists, if any
+        ids = None
+        if self.ann is not None and not exact:
+            ids = np.sort(self.ann.candidates(query, nprobe))
+
+        if self.codes is not None and not exact:
+            codes = self.codes if ids is None else self.codes[ids]
+            approx = self.quantizer.scores(codes, query)
+            keep = top_k_indices(approx, max(count, self.rescore))
+            candidates = keep if ids is None else ids[keep]
+            if not self.rescore:
+                return candidates[:count], approx[keep][:count]
+            # Exact re-score of the shortlist; only these rows of the float matrix are read
+            ids, approx = np.sort(candidates), None
+
+        vectors = self.matrix if ids is None else self.matrix[ids]
+        similarities = np.asarray(vectors, dtype=np.float32) @ query
+        ranked = top_k_indices(similarities, count)
+        return (ranked if ids is None else ids[ranked]), similarities[ranked]
+
+    def _rank_hybrid(self, query, query_text, count, nprobe=None, exact=False):
+        """Dense ranking fused with the BM25 ranking; scores returned are still cosine similarities"""
+        dense_ids, _ = self._rank(query, count, nprobe, exact)
+        lexical_scores = self.lexical.scores(query_text)
+        lexical_ids = top_k_indices(lexical_scores, count)
+        lexical_ids = lexical_ids[lexical_scores[lexical_ids] > 0]
+
+        candidates = np.union1d(dense_ids, lexical_ids)
+        similarities = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+        if self.hybrid == 'weighted':
+            best_lexical = lexical_scores[lexical_ids[0]] if len(lexical_ids) else 1.0
+            fused = (1 - HYBRID_WEIGHT) * similarities + HYBRID_WEIGHT * lexical_scores[candidates] / best_lexical
+        else:
+            fused = np.zeros(len(candidates), dtype=np.float32)
+            for ranking in (dense_ids, lexical_ids):
+                positions = np.searchsorted(candidates, ranking)
+                fused[positions] += 1.0 / (RRF_K + 1 + np.arange(len(ranking)))
+        order = top_k_indices(fused, count)
+        return candidates[order], similarities[order]
+
+    def search(self, query_embedding, top_k=5, max_passages=2, nprobe=None, query_text=None):
+        """Top_k documents for an already-encoded query.
+
+        Each result carries the best-matching passages; for chunked indexes passage hits are
+        collapsed back to their documents and 'content' is the best passage. With query_text
+        and a BM25 index attached, the ranking fuses lexical and dense scores.
+        """
+        if not len(self.records):
+            return []
+
+        query = self._normalize_query(query_embedding)
+        if query_text and self.lexical is not None and self.hybrid != 'off':
+            rank = lambda count: self._rank_hybrid(query, query_text, count, nprobe)
+        else:
+            rank = lambda count: self._rank(query, count, nprobe)
+        if not self.chunked:
+            ranked, similarities = rank(top_k)
+        else:
+            # Over-fetch passages so top_k distinct documents survive the collapse; when a few long
+            # documents take every slot, widen the (still approximate) fetch instead of scanning all rows
+            count = top_k * (max_passages + 4)
+            limit = min(len(self.records), max(count, MAX_OVERFETCH))
+            while True:
+                ranked, similarities = rank(count)
+                if count >= limit or len({self.file_path(idx) for idx in ranked}) >= top_k:
+                    break
+                count = min(count * 2, limit)
+
+        results = []
+        by_document = {}
+        complete = 0  # Documents that already have max_passages passages
+        for idx, similarity in zip(ranked, similarities):
+            # Only the file path is read for rows that are skipped; hits are decoded in full
+            result = by_document.get(self.file_path(idx))
+            if result is None:
+                if len(results) == top_k:
+                    continue
+                record = self.records[idx]
+                result = {
+                    'similarity': float(similarity),
+                    'content': record['content'],
+                    'source_url': record.get('source_url'),
+                    'file_path': record['file_path'],
+                    'passages': []
+                }
+                by_document[record['file_path']] = result
+                results.append(result)
+            elif len(result['passages']) >= max_passages:
+                continue
+            else:
+                record = self.records[idx]
+            result['passages'].append({
+                'content': record['content'],
+                'similarity': float(similarity),
+                'chunk_start': record.get('chunk_start'),
+                'chunk_end': record.get('chunk_end')
+            })
+            if len(result['passages']) == max_passages:
+                complete += 1
+                if complete == top_k:
+                    break
+        return results
+
+    def file_path(self, idx):
+        """file_path of row idx, without decoding the row's content"""
+        if isinstance(self.records, StoreRecords):
+            return self.records.file_path(idx)
+        return self.records[idx]['file_path']
+
+def load_search_index(path, load_embeddings, index_type=None, hybrid=None):
+    """Build a SearchIndex for an embeddings file; binary stores keep their memory-mapped vectors"""
+    if is_store_path(path):
+        # Only the hits' content and metadata are decoded, at query time
+        store = EmbeddingStore(path)
+        index = SearchIndex(store.vectors, StoreRecords(store), chunked=store.chunked)
+    else:
+        index = SearchIndex.from_embeddings(load_embeddings(path))
+
+    index.path = path
+    index.version = index_version(path)
+
+    index_type = index_type or INDEX_TYPE
+    if index_type == 'auto':
+        index_type = 'ivf' if len(index) >= AUTO_IVF_MIN_ROWS else 'flat'
+    if index_type == 'ivf' and len(index):
+        attach_ann(index, path)
+    if QUANTIZATION != 'none' and len(index):
+        attach_quantized(index, path, QUANTIZATION)
+    index.hybrid = hybrid or HYBRID
+    if index.hybrid != 'off' and len(index):
+        attach_lexical(index, path)
+    return index
+
+# Indexes loaded through get_search_index, shared by the app and the start-up warm-up
+_loaded_indexes = {}
+_loaded_lock = threading.Lock()
+
+def get_search_index(path, load_embeddings, index_type=None):
+    """Process-wide SearchIndex for path, loaded once and reloaded when the file changes"""
+    key = os.path.abspath(str(path))
+    with _loaded_lock:
+        index = _loaded_indexes.get(key)
+        if index is None or index.version != index_version(path):
+            index = load_search_index(path, load_embeddings, index_type)
+            _loaded_indexes[key] = index
+    return index
+
+def index_version(path):
+    """Changes whenever the embeddings file or store is rewritten"""
+    stat_path = os.path.join(path, META_FILE) if is_store_path(path) else path
+    stat = os.stat(stat_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def _modified_time(path):
+    if is_store_path(path):
+        path = os.path.join(path, META_FILE)
+    return os.path.getmtime(path)
+
+def attach_ann(index, embeddings_path):
+    """Load the saved IVF index for this embeddings file, building and saving it if missing or stale"""
+    ann_path = ann_path_for(embeddings_path)
+    ann = None
+    if os.path.exists(ann_path):
+        ann = IVFIndex.load(ann_path, nprobe=IVF_NPROBE)
+        if (ann.list_offsets[-1] != len(index)
+                or os.path.getmtime(ann_path) < _modified_time(embeddings_path)):
+            print(f"IVF index {ann_path} is out of date, rebuilding")
+            ann = None
+    if ann is None:
+        ann = IVFIndex.build(index.matrix, nprobe=IVF_NPROBE)
+        try:
+            ann.save(ann_path)
+        except OSError as e:
+            print(f"Could not save IVF index to {ann_path}: {str(e)}")
+    index.ann = ann
+    return ann
+
+# Index for the plain embeddings list most recently passed to as_search_index
+_last_index = (None, None)
+
+def as_search_index(embeddings_data):
+    """Return embeddings_data as a SearchIndex, building one only when given a new list"""
+    global _last_index
+    if isinstance(embeddings_data, SearchIndex):
+        return embeddings_data
+    cached_data, index = _last_index
+    if cached_data is not embeddings_data or len(index) != len(embeddings_data):
+        index = SearchIndex.from_embeddings(embeddings_data)
+        _last_index = (embeddings_data, index)
+    return index
+
+def attach_quantized(index, embeddings_path, method):
+    """Load saved quantized codes for this embeddings file, building and saving them if missing or stale"""
+    loaded = load_quantized(embeddings_path, method)
+    codes_path = quantized_paths(embeddings_path, method)[0]
+    if loaded is not None and (len(loaded[1]) != len(index)
+                               or os.path.getmtime(codes_path) < _modified_time(embeddings_path)):
+        print(f"Quantized {method} codes for {embeddings_path} are out of date, rebuilding")
+        loaded = None
+    if loaded is None:
+        try:
+            loaded = build_quantized(index.matrix, method, embeddings_path)
+        except OSError as e:
+            print(f"Could not save {method} codes for {embeddings_path}: {str(e)}")
+            loaded = build_quantized(index.matrix, method)
+    index.quantizer, index.codes = loaded
+    return loaded
+
+def attach_lexical(index, embeddings_path):
+    """Load the BM25 index saved with these embeddings, building and saving it if missing or stale"""
+    bm25_path = bm25_path_for(embeddings_path)
+    lexical = None
+    if os.path.exists(bm25_path):
+        lexical = BM25Index.load(bm25_path)
+        if lexical.num_docs != len(index) or os.path.getmtime(bm25_path) < _modified_time(embeddings_path):
+            print(f"BM25 index {bm25_path} is out of date, rebuilding")
+            lexical = None
+    if lexical is None:
+        try:
+            lexical = build_bm25_index(index.records, embeddings_path)
+        except OSError as e:
+            print(f"Could not save BM25 index to {bm25_path}: {str(e)}")
+            lexical = build_bm25_index(index.records)
+    index.lexical = lexical
+    return lexical
@@ -2,11 +2,50 @@
 """
 Startup script for Railway deployment
 Hardcoded to port 8080 for Railway compatibility
+
+Streamlit runs in this process, next to the health endpoints (health_server.py) and a
+warm-up thread that loads the search index and embedding model before the first visitor.
+/readyz turns ready when the warm-up finishes.
 """
 
 import os
-import subprocess
 import sys
+import threading
+
+# Candidates for the start-up warm-up, in the same preference order as docusearch_light.py
+WARM_UP_INDEX_PATHS = [
+    "embeddings/embeddings_light.store",
+    "embeddings/embeddings_light.json",
+    "embeddings/embeddings.json"
+]
+
+def warm_up_in_background():
+    """Load the search index and embedding model in a thread; readiness waits for both"""
+    import health_server
+
+    def run():
+        try:
+            if os.getenv('DOCUSEARCH_BACKEND', 'dense') == 'tfidf':
+                from tfidf_search import load_tfidf_index
+                path = os.getenv('DOCUSEARCH_TFIDF_INDEX') or "embeddings/embeddings_light.tfidf"
+                health_server.mark_index_loaded(load_tfidf_index(path))
+                return
+            from create_embeddings_light import load_embeddings, get_processor
+            from search_index import get_search_index
+            path = next((path for path in WARM_UP_INDEX_PATHS if os.path.exists(path)), None)
+            if path is None:
+                print("⚠️  No embeddings found to warm up")
+                return
+            health_server.mark_index_loaded(get_search_index(path, load_embeddings))
+            get_processor()
+            print("✅ Warm-up complete")
+        except Exception as e:
+            print(f"❌ Warm-up failed: {e}")
+
+    if os.getenv('DOCUSEARCH_BACKEND', 'dense') != 'tfidf':
+        from create_embeddings_light import DEFAULT_MODEL
+        health_server.expect_model(("LightEmbeddingProcessor", DEFAULT_MODEL))
+    threading.Thread(target=run, daemon=True).start()
 
 def main():
     # Hardcode port to 8080 for Railway
@@ -30,23 +69,30 @@ def main():
     os.makedirs('/tmp/torch_cache', exist_ok=True)
     os.makedirs('/tmp/hf_cache', exist_ok=True)
     
-    # Check if embeddings file exists
-    if not os.path.exists('embeddings/embeddings_light.json'):
+    # Check if embeddings file exists (the TF-IDF image ships only the prebuilt index)
+    if os.getenv('DOCUSEARCH_BACKEND', 'dense') == 'tfidf':
+        if not os.path.isdir(os.getenv('DOCUSEARCH_TFIDF_INDEX') or 'embeddings/embeddings_light.tfidf'):
+            print("⚠️  Warning: TF-IDF index not found")
+            print("   Build it with: python tfidf_search.py embeddings/embeddings_light.json")
+    elif not os.path.exists('embeddings/embeddings_light.json'):
         print("⚠️  Warning: embeddings_light.json not found")
         print("   The app will need to generate embeddings.")
     
-    # Start Streamlit
+    # Probe endpoints and warm-up run in this process, so they see the app's index and model
+    import health_server
+    health_server.start_health_server()
+    warm_up_in_background()
+    
+    # Start Streamlit in this process (a subprocess would not share the loaded model)
+    from streamlit.web import cli as stcli
+    sys.argv = [
+        'streamlit', 'run', 'docusearch_light.py',
+        '--server.port', str(port),
+        '--server.address', '0.0.0.0'
+    ]
+    print(f"Running: {' '.join(sys.argv)}")
     try:
-        cmd = [
-            sys.executable, '-m', 'streamlit', 'run', 'docusearch_light.py',
-            '--server.port', str(port),
-            '--server.address', '0.0.0.0'
-        ]
-        print(f"Running: {' '.join(cmd)}")
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error starting Streamlit: {e}")
-        sys.exit(1)
+        sys.exit(stcli.main())
     except KeyboardInterrupt:
         print("\n👋 Shutting down...")
         sys.exit(0)
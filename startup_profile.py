@@ -0,0 +1,87 @@
+"""
+Startup timing for the Streamlit apps and lazy imports of heavy dependencies.
+
+Import this module first: the clock starts when it is loaded. phase(), checkpoint() and
+timed_import() record how long each startup step and each deferred import took; report()
+prints the breakdown once per process and exports it through metrics. import_torch() is the
+timed torch import the embedding processors share.
+"""
+
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+PROCESS_START = time.perf_counter()
+
+_timings = []  # (name, seconds) in the order they finished
+_reported = False
+_last_checkpoint = PROCESS_START
+_lock = threading.Lock()
+
+def _record(name, seconds):
+    with _lock:
+        _timings.append((name, seconds))
+    metrics.observe(f"startup_{name.replace(' ', '_').replace('.', '_')}_seconds", seconds)
+
+@contextmanager
+def phase(name):
+    """Time a block of startup work"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Streamlit reruns the script on every interaction; only the first run is startup
+        if not _reported:
+            _record(name, time.perf_counter() - start)
+
+def checkpoint(name):
+    """Record the time since the previous checkpoint (or since start) under name"""
+    global _last_checkpoint
+    if _reported:
+        return
+    now = time.perf_counter()
+    with _lock:
+        seconds, _last_checkpoint = now - _last_checkpoint, now
+    _record(name, seconds)
+
+def timed_import(module_name):
+    """Import module_name on first use, recording how long the import took"""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _record(f"import {module_name}", time.perf_counter() - start)
+    return module
+
+class _TorchClassesStub:
+    def __getattr__(self, attr):
+        return None
+
+def import_torch():
+    """timed_import('torch'), with torch.classes replaced once so Streamlit's file watcher doesn't trip over it"""
+    torch = timed_import('torch')
+    if not isinstance(torch.classes, _TorchClassesStub):
+        torch.classes = _TorchClassesStub()
+    return torch
+
+def timings():
+    with _lock:
+        return list(_timings)
+
+def report(label="First page ready"):
+    """Print the startup breakdown the first time it is called in this process"""
+    global _reported
+    with _lock:
+        if _reported:
+            return
+        _reported = True
+    elapsed = time.perf_counter() - PROCESS_START
+    metrics.observe('startup_time_to_first_page_seconds', elapsed)
+    print(f"{label} {elapsed:.2f}s after start")
+    for name, seconds in sorted(timings(), key=lambda item: -item[1]):
+        print(f"  {seconds:7.3f}s  {name}")
@@ -12,15 +12,8 @@ current_file = Path(__file__).resolve()
 parent_directory = current_file.parent
 sys.path.append(str(parent_directory))
 
-from create_embeddings import search_embeddings
-
-def load_embeddings(file_path):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    # Convert lists to numpy arrays for similarity calculations
-    for item in data:
-        item['embedding'] = np.array(item['embedding'])
-    return data
+from create_embeddings import search_embeddings, load_embeddings
+from search_index import load_search_index
 
 def main():
     # Add mode selection in sidebar
@@ -36,10 +29,10 @@ def main():
         st.error(f"Error: Embeddings file not found at {embeddings_file}. Please run create_embeddings.py first.")
         return
     
-    # Load embeddings (only once when the app starts)
-    @st.cache_data
+    # Build the search index once per process and share it across sessions
+    @st.cache_resource
     def load_cached_embeddings():
-        return load_embeddings(embeddings_file)
+        return load_search_index(embeddings_file, load_embeddings)
     
     embeddings_data = load_cached_embeddings()
     
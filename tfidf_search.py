@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Search backend on a sparse TF-IDF matrix, for replicas that must start fast without torch.
+
+The vectorizer and matrix are fitted at build time and saved in a `.tfidf` directory:
+
+    vectorizer.pkl  - fitted scikit-learn TfidfVectorizer
+    matrix.npz      - L2-normalized document-term matrix (scipy CSR)
+    records.json    - file_path, source_url and content of each matrix row
+
+Usage: python tfidf_search.py <embeddings file, store or text folder> [embeddings/embeddings_light.tfidf]
+
+Select it in docusearch_light.py with DOCUSEARCH_BACKEND=tfidf (needs only requirements_tfidf_only.txt).
+The functions mirror create_embeddings_light: load_embeddings, search_embeddings, warm_up.
+"""
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+TFIDF_SUFFIX = ".tfidf"
+VECTORIZER_FILE = "vectorizer.pkl"
+MATRIX_FILE = "matrix.npz"
+RECORDS_FILE = "records.json"
+
+def tfidf_path_for(path):
+    """Default .tfidf directory for an embeddings file, store or text folder"""
+    return os.path.splitext(str(path).rstrip("/\\"))[0] + TFIDF_SUFFIX
+
+def _top_k_indices(scores, top_k):
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.array([], dtype=int)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k] if top_k < len(scores) else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+class TfidfIndex:
+    """Fitted vectorizer plus the row id -> document metadata mapping, searched like SearchIndex"""
+
+    def __init__(self, vectorizer, matrix, records):
+        self.vectorizer = vectorizer
+        self.matrix = matrix.tocsr()
+        self.records = records
+        self.path = None
+        self.version = None
+
+    @classmethod
+    def build(cls, records, **vectorizer_kwargs):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        settings = {'sublinear_tf': True, 'min_df': 1, 'max_df': 0.95, 'dtype': np.float32}
+        settings.update(vectorizer_kwargs)
+        vectorizer = TfidfVectorizer(**settings)
+        matrix = vectorizer.fit_transform([record.get('content', '') for record in records])
+        return cls(vectorizer, matrix, records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, idx):
+        return self.records[idx]
+
+    def documents(self):
+        """One record per document"""
+        seen = set()
+        documents = []
+        for record in self.records:
+            if record['file_path'] not in seen:
+                seen.add(record['file_path'])
+                documents.append(record)
+        return documents
+
+    def search(self, query, top_k=5, max_passages=2):
+        """Top_k documents for the query text, in the same shape as SearchIndex.search"""
+        if not self.records:
+            return []
+        # Rows and the query are L2-normalized, so the dot product is the cosine similarity
+        scores = (self.matrix @ self.vectorizer.transform([query]).T).toarray().ravel()
+        # Passage rows of one document are collapsed, so over-fetch a little
+        ranked = _top_k_indices(scores, top_k * (max_passages + 4))
+
+        results = []
+        by_document = {}
+        for idx in ranked:
+            record = self.records[idx]
+            passage = {
+                'content': record['content'],
+                'similarity': float(scores[idx]),
+                'chunk_start': record.get('chunk_start'),
+                'chunk_end': record.get('chunk_end')
+            }
+            result = by_document.get(record['file_path'])
+            if result is None:
+                if len(results) == top_k:
+                    continue
+                result = {
+                    'similarity': passage['similarity'],
+                    'content': record['content'],
+                    'source_url': record.get('source_url'),
+                    'file_path': record['file_path'],
+                    'passages': []
+                }
+                by_document[record['file_path']] = result
+                results.append(result)
+            if len(result['passages']) < max_passages:
+                result['passages'].append(passage)
+        return results
+
+    def save(self, path):
+        """Write the index to a .tfidf directory, replacing it atomically"""
+        from scipy import sparse
+        path = str(path).rstrip("/\\")
+        tmp_path = path + ".tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(os.path.join(tmp_path, VECTORIZER_FILE), 'wb') as f:
+            pickle.dump(self.vectorizer, f)
+        sparse.save_npz(os.path.join(tmp_path, MATRIX_FILE), self.matrix)
+        with open(os.path.join(tmp_path, RECORDS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.records, f)
+        if os.path.isdir(path):
+            old_path = path + ".old"
+            os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            for name in os.listdir(old_path):
+                os.remove(os.path.join(old_path, name))
+            os.rmdir(old_path)
+        else:
+            os.replace(tmp_path, path)
+
+def load_tfidf_index(path):
+    from scipy import sparse
+    with open(os.path.join(path, VECTORIZER_FILE), 'rb') as f:
+        vectorizer = pickle.load(f)
+    matrix = sparse.load_npz(os.path.join(path, MATRIX_FILE))
+    with open(os.path.join(path, RECORDS_FILE), 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    index = TfidfIndex(vectorizer, matrix, records)
+    index.path = path
+    stat = os.stat(os.path.join(path, MATRIX_FILE))
+    index.version = f"{stat.st_size}-{stat.st_mtime_ns}"
+    return index
+
+def _read_records(source):
+    """Records (file_path, source_url, content) from a text folder or an embeddings file/store"""
+    if os.path.isdir(source) and not source.rstrip("/\\").endswith(".store"):
+        from embedding_pipeline import collect_text_files
+        documents = collect_text_files(source)
+    elif source.rstrip("/\\").endswith(".store"):
+        from embedding_store import load_embedding_store
+        documents = load_embedding_store(source)
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            documents = json.load(f)
+    return [{key: document.get(key) for key in ('file_path', 'source_url', 'content', 'chunk_start', 'chunk_end')
+             if document.get(key) is not None}
+            for document in documents]
+
+def build_tfidf_index(source, output_path=None):
+    """Fit the vectorizer on every record of source and save the index next to it"""
+    output_path = output_path or tfidf_path_for(source)
+    start = time.perf_counter()
+    index = TfidfIndex.build(_read_records(source))
+    index.save(output_path)
+    print(f"Built TF-IDF index of {len(index)} rows x {index.matrix.shape[1]} terms "
+          f"in {time.perf_counter() - start:.2f}s, saved to {output_path}")
+    return index
+
+# Same entry points as create_embeddings_light, so the app can swap backends
+
+def load_embeddings(path):
+    try:
+        return load_tfidf_index(path)
+    except FileNotFoundError:
+        print(f"TF-IDF index not found: {path}")
+        return []
+
+def search_embeddings(query, embeddings_data, top_k=5):
+    if not embeddings_data:
+        return []
+    return embeddings_data.search(query, top_k)
+
+def warm_up(model_name=None):
+    """Nothing to load: the vectorizer comes with the index"""
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a TF-IDF search index")
+    parser.add_argument("source", help="Embeddings JSON file, .store directory or folder of text files")
+    parser.add_argument("output", nargs="?", help="Output .tfidf directory")
+    args = parser.parse_args()
+    if not os.path.exists(args.source):
+        print(f"Not found: {args.source}")
+        sys.exit(1)
+    build_tfidf_index(args.source, args.output)
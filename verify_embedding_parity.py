@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Parity check of batched document embeddings against per-text query embeddings.
+
+create_embeddings() encodes whole batches through the underlying SentenceTransformer, while
+queries go through create_embedding() (langchain's embed_query for the full processor). Both
+must produce the same vectors, or stored documents and queries would not be comparable.
+
+Usage: python verify_embedding_parity.py [--light] [--model NAME_OR_PATH] [--batch-size 2]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+SAMPLE_TEXTS = [
+    "How do I set up a pay plan for my water bill?",
+    "Start, stop or transfer service\nwhen moving to a new address",
+    "Meter reading and rate questions " * 40,
+    "Revenue assurance",
+    ""
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check batched embeddings against per-text embeddings")
+    parser.add_argument("--light", action="store_true", help="Check create_embeddings_light instead of create_embeddings")
+    parser.add_argument("--model", help="Model name or local path (default: the module's DEFAULT_MODEL)")
+    parser.add_argument("--batch-size", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.light:
+        import create_embeddings_light as module
+        processor_class = module.LightEmbeddingProcessor
+    else:
+        import create_embeddings as module
+        processor_class = module.EmbeddingProcessor
+    processor = processor_class(args.model or module.DEFAULT_MODEL)
+
+    batched = np.asarray(processor.create_embeddings(SAMPLE_TEXTS, batch_size=args.batch_size), dtype=np.float32)
+    single = np.asarray([processor.create_embedding(text) for text in SAMPLE_TEXTS], dtype=np.float32)
+    max_error = float(np.max(np.abs(batched - single)))
+    # float16 models (the light processor) differ slightly between batch and single-text passes
+    matches = batched.shape == single.shape and np.allclose(batched, single, atol=1e-3 if args.light else 1e-5)
+    print(f"{processor.model_name}: {len(SAMPLE_TEXTS)} texts, batch size {args.batch_size}, "
+          f"max abs difference {max_error:.2e}, norms {np.round(np.linalg.norm(batched, axis=1), 4).tolist()}")
+    print("Batched and per-text embeddings match" if matches else "Batched and per-text embeddings DIFFER")
+    sys.exit(0 if matches else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Equality check of the vectorized search against the per-item reference loop.
+
+For random query vectors (and perturbed copies of document vectors), SearchIndex.search on a
+flat index with hybrid search off must return the same documents, in the same order and with
+the same similarities, as create_embeddings_light.rank_reference. Both the JSON file and a
+binary store converted from it are checked. Needs no embedding model.
+
+Usage: python verify_search.py [embeddings/embeddings_light.json] [--queries 50] [--top-k 10]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from create_embeddings_light import rank_reference
+from embedding_store import save_embedding_store
+from search_index import load_search_index
+
+def check(index, embeddings_data, queries, top_k):
+    """Number of queries whose results differ from the reference"""
+    mismatches = 0
+    for query in queries:
+        expected = rank_reference(query, embeddings_data, top_k)
+        actual = index.search(query, top_k)
+        same_order = [item['file_path'] for item in expected] == [item['file_path'] for item in actual]
+        same_scores = np.allclose([item['similarity'] for item in expected],
+                                  [item['similarity'] for item in actual], atol=1e-5)
+        if not (same_order and same_scores):
+            mismatches += 1
+    return mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Check vectorized search against the reference loop")
+    parser.add_argument("embeddings_path", nargs="?", default="embeddings/embeddings_light.json")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.embeddings_path, 'r', encoding='utf-8') as f:
+        embeddings_data = json.load(f)
+    if any('chunk_index' in item for item in embeddings_data):
+        print("The reference ranks single rows; use unchunked embeddings")
+        sys.exit(2)
+
+    rng = np.random.default_rng(0)
+    vectors = np.asarray([item['embedding'] for item in embeddings_data], dtype=np.float32)
+    random_queries = rng.standard_normal((args.queries, vectors.shape[1]))
+    near_queries = vectors[rng.integers(len(vectors), size=args.queries)] + 0.1 * rng.standard_normal(
+        (args.queries, vectors.shape[1]))
+    queries = np.concatenate([random_queries, near_queries]).astype(np.float32)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        store_path = os.path.join(tmp, "embeddings.store")
+        save_embedding_store(embeddings_data, store_path)
+        for label, path in (("JSON", args.embeddings_path), ("store", store_path)):
+            index = load_search_index(path, lambda _: embeddings_data, index_type='flat', hybrid='off')
+            mismatches = check(index, embeddings_data, queries, args.top_k)
+            print(f"{label}: {len(queries) - mismatches}/{len(queries)} queries match the reference")
+            failed = failed or mismatches > 0
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()